@@ -1,3 +1,4 @@
+import os
 from datetime import datetime
 
 # SCOPE
@@ -5,6 +6,23 @@ LIST_OF_STOCKS = ["MSFT", "AAPL", "NVDA", "AMZN", "GOOG", "META", "TSLA"]
 BACKTEST_START = datetime(1981, 1, 1)
 BACKTEST_END = datetime(2023, 12, 31)
 
+# DATA
+PRICE_STORE_PATH = os.path.join("data", "price_store")
+INTRADAY_STORE_PATH = os.path.join("data", "intraday_store")
+PRICE_SOURCE_URL = "https://query1.finance.yahoo.com/v8/finance/chart"
+RSI_PERIOD = 14
+
+# CACHE OF INDICATORS AND WEIGHTS
+CACHE_ENABLED = True
+CACHE_PATH = os.path.join("data", "cache")
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# BENCHMARKS
+BENCHMARK_BASELINE_PATH = os.path.join("data", "benchmark_baseline.json")
+
+# EXPERIMENTS
+EXPERIMENTS_PATH = os.path.join("data", "experiments")
+
 # TRADING SETUP & CONSTRAINTS
 CAPITAL_0 = 1e6
 COMMISSION_RATE = .0010
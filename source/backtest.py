@@ -1,8 +1,13 @@
+import json
+
 import pandas as pd
 import numpy as np
 
 from config import CAPITAL_0, COMMISSION_RATE, SLIPPAGE_RATE, MIN_TRANSC, MAX_PROP
+from source.price_store import append_prices, load_prices, stored_tickers
+from source.instrumentation import timed, count
 
+@timed("backtest")
 def run_backtest(positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal"):
     """
     Conduct backtesting.
@@ -46,6 +51,7 @@ def run_backtest(positions_signals, prices_open, prices_close, weights = None, a
 
         # EXECUTION
         if signal_changed:
+            count("rebalance_days")
             # ALLOCATE EQUAL-INVESTMENT WEIGHT, SATISFY MAX SIZE RELATIVE TO AUM
             funds_to_allocate = prev_aum * np.clip(current_eligible_count * MAX_PROP, 0, 1)
             if funds_to_allocate > 0:
@@ -76,6 +82,7 @@ def run_backtest(positions_signals, prices_open, prices_close, weights = None, a
                 cash_account_pending = cash_account - (cost.sum() + fees.sum())
                 if cash_account_pending < 0:
                     # NO ACTION IF NOT ENOUGH CASH TO EXECUTE
+                    count("rejected_rebalances")
                     portfolio.loc[date, :] = portfolio.loc[prev_date, :]
                     portfolio_value.loc[date, :] = portfolio.loc[date, :] * current_close
                 else:
@@ -112,4 +119,658 @@ def run_backtest(positions_signals, prices_open, prices_close, weights = None, a
     # MERGE CASH HISTORY
     portfolio_value = pd.concat((portfolio_value, cash_accounts), axis = 1).dropna()
 
-    return portfolio, portfolio_value, trade_count.dropna()
\ No newline at end of file
+    return portfolio, portfolio_value, trade_count.dropna()
+
+def _find_signal_changes(signals):
+    """
+    Find the trading days on which the position signal differs from the previous day.
+
+    Parameters:
+        signals (np.ndarray): Array of market signals, shape is (num of trading days, num of instruments).
+
+    Returns:
+        np.ndarray: Boolean array of shape (num of trading days, ), True on days the signal changed. The first day is never a change.
+    """
+    changed = signals[1:] != signals[:-1]
+    if np.issubdtype(signals.dtype, np.floating):
+        # NAN IS TREATED AS EQUAL TO NAN, AS IN pd.Series.equals
+        changed &= ~(np.isnan(signals[1:]) & np.isnan(signals[:-1]))
+    return np.concatenate(([False], changed.any(axis = 1)))
+
+def _signal_array(positions_signals):
+    """
+    Convert positions signals to an array. Object columns (eg. a ticker without any RSI value) are converted to float,
+    so that missing signals compare as in pd.Series.equals and are summed as NaN.
+
+    Returns:
+        np.ndarray: Array of market signals, of a numeric dtype, shape is (num of trading days, num of instruments).
+    """
+    signals = positions_signals.to_numpy()
+    return signals if signals.dtype.kind in "iubf" else signals.astype(float)
+
+def _target_portfolio(funds_to_each, signal, open_, weights, columns, allocation_method):
+    """
+    Calculate the target portfolio (in number of shares) on a rebalancing day, of one strategy or of several strategies stacked as rows.
+
+    Parameters:
+        funds_to_each (float or np.ndarray): Funds allocated to each eligible instrument, shape is (num of strategies, 1) for several strategies.
+        signal (np.ndarray): Market signals of the day, shape is (num of instruments, ) or (num of strategies, num of instruments).
+        open_ (np.ndarray): Market open prices of the day with missing prices as NaN, shape is (num of instruments, ).
+        weights (np.ndarray): Weights of the day, shape of signal. Unused for "equal".
+        columns (pd.Index): Instruments, used to reproduce the label alignment of the "voladj" method.
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+
+    Returns:
+        target (np.ndarray): Target number of shares, shape of signal.
+        order (np.ndarray): Order in which the instruments are summed for cash accounting, shape of signal, or None to keep the column order.
+    """
+    order = None
+    match allocation_method:
+        case "equal":
+            target = (funds_to_each * signal) // open_
+        case "hrp":
+            # SEQUENTIAL SUM, AS THE BUILT-IN sum()
+            weights_ = weights / np.cumsum(weights, axis = -1)[..., -1:]
+            target = (funds_to_each * signal) * weights_ // open_
+        case "voladj":
+            eligible = signal > 0
+            weights_ = np.where(eligible, weights, np.nan)
+            weights_[weights_ < 0] = 0
+            with np.errstate(invalid = "ignore"):
+                # NO POSITIVE WEIGHT (0 / 0) GIVES NO POSITIONS, SILENTLY AS IN run_backtest()
+                weights_ = weights_ / np.where(np.isnan(weights_), 0, weights_).sum(axis = -1, keepdims = True)
+            target = (funds_to_each * signal) * weights_ // open_
+            subset = ~eligible.all(axis = -1)
+            if subset.any():
+                # ALIGNING ANY SUBSET OF INSTRUMENTS SORTS THE LABELS
+                sorted_order = columns.get_indexer(columns.union(columns[:-1]))
+                order = np.where(subset[..., np.newaxis], sorted_order, np.arange(len(columns)))
+        case _:
+            raise ValueError(f"Invalid allocation_method: {allocation_method}")
+    target[np.isnan(target)] = 0
+    return target, order
+
+def _new_backtest_state(num_instruments):
+    """
+    Initial state of a backtest, carried over from one block of trading days to the next.
+
+    Parameters:
+        num_instruments (int): Number of instruments.
+
+    Returns:
+        dict: Cash account, holdings (in number of shares), and the signal and close prices of the last day seen.
+    """
+    return {"cash_account" : CAPITAL_0, "holdings" : np.zeros(num_instruments), "prev_signal" : None, "prev_close" : np.zeros(num_instruments)}
+
+def _prepare_block(positions_signals, prices_open, prices_close, weights, allocation_method):
+    """
+    Convert the inputs of a block of trading days to arrays aligned to positions_signals.
+
+    Returns:
+        tuple: (signals, opens, opens_nan, closes, weights) arrays, missing prices set to 0 (opens, closes) or NaN (opens_nan).
+    """
+    index, columns = positions_signals.index, positions_signals.columns
+    if allocation_method != "equal":
+        assert weights is not None, f"Weights cannot be None when {allocation_method} is chosen."
+        weights = weights.reindex(index = index, columns = columns).to_numpy(dtype = float)
+    signals = _signal_array(positions_signals)
+    opens = prices_open.loc[index, columns].to_numpy(dtype = float)
+    opens[np.isnan(opens)] = 0
+    closes = prices_close.loc[index, columns].to_numpy(dtype = float)
+    closes[np.isnan(closes)] = 0
+    # MISSING OR ZERO OPEN PRICES CANNOT BE BOUGHT
+    opens_nan = np.where(opens == 0, np.nan, opens)
+    return signals, opens, opens_nan, closes, weights
+
+def _simulate_block(signals, opens, opens_nan, closes, weights, columns, allocation_method, state):
+    """
+    Simulate a block of consecutive trading days, rebalancing only on days where the signal changes.
+
+    Parameters:
+        signals, opens, opens_nan, closes, weights (np.ndarray): Arrays of the block returned by _prepare_block().
+        columns (pd.Index): Instruments.
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+        state (dict): State returned by _new_backtest_state() or left by the previous block, updated in place.
+
+    Returns:
+        portfolio (np.ndarray): Number of shares held at market close, shape is (num of trading days, num of instruments).
+        cash_accounts (np.ndarray): Cash account at market close, NaN on the first day of the backtest, shape is (num of trading days, ).
+        trade_count (np.ndarray): Number of trades executed, shape is (num of trading days, ).
+    """
+    num_days, num_instruments = signals.shape
+    # TO STORE POSITIONS (NUMBER OF SHARES), CASH ACCOUNT SIZE AND NUMBER OF TRADES AT MARKET CLOSE
+    portfolio = np.zeros((num_days, num_instruments))
+    cash_accounts = np.full(num_days, np.nan)
+    trade_count = np.zeros(num_days, dtype = int)
+
+    cash_account, holdings = state["cash_account"], state["holdings"]
+    if state["prev_signal"] is None:
+        # FIRST DAY OF THE BACKTEST, NOTHING TO COMPARE AGAINST
+        rebalance_days = np.flatnonzero(_find_signal_changes(signals))
+        first_day = 1
+    else:
+        rebalance_days = np.flatnonzero(_find_signal_changes(np.vstack((state["prev_signal"], signals)))[1:])
+        first_day = 0
+    prev_closes = np.vstack((state["prev_close"], closes[:-1]))
+    segment_ends = np.append(rebalance_days, num_days)
+    # HOLD THE CURRENT PORTFOLIO UNTIL THE FIRST SIGNAL CHANGE
+    portfolio[:segment_ends[0]] = holdings
+    cash_accounts[first_day:segment_ends[0]] = cash_account
+
+    rejected = 0
+    for day, segment_end in zip(rebalance_days, segment_ends[1:]):
+        # COLLECTING INFORMATION
+        ## PRE-MARKET
+        prev_aum = cash_account + (holdings * prev_closes[day]).sum()
+        current_signal = signals[day]
+        # SEQUENTIAL SUM AS THE BUILT-IN sum(), WIDENED FOR COMPACT INTEGER SIGNALS
+        current_eligible_count = current_signal.sum(dtype = np.int64) if signals.dtype.kind in "iub" else sum(current_signal)
+
+        # EXECUTION
+        # ALLOCATE EQUAL-INVESTMENT WEIGHT, SATISFY MAX SIZE RELATIVE TO AUM
+        funds_to_allocate = prev_aum * np.clip(current_eligible_count * MAX_PROP, 0, 1)
+        order = None
+        if funds_to_allocate > 0:
+            # SIGNAL CHANGED, WITH ELIGIBLE STOCKS
+            funds_to_each = funds_to_allocate / current_eligible_count
+            current_portfolio, order = _target_portfolio(
+                funds_to_each, current_signal, opens_nan[day], None if weights is None else weights[day], columns, allocation_method
+            )
+        else:
+            # SIGNAL CHANGED BUT NOW HOLD NO STOCKS (IE SELL EVERYTHING)
+            current_portfolio = np.zeros(num_instruments)
+
+        change_in_portfolio = current_portfolio - holdings
+        change_in_portfolio = np.clip(np.abs(change_in_portfolio), MIN_TRANSC, None) * np.sign(change_in_portfolio)
+        cost = change_in_portfolio * opens[day]
+        fees = np.abs(cost) * (COMMISSION_RATE + SLIPPAGE_RATE)
+        if order is not None:
+            cost, fees = cost[order], fees[order]
+        cash_account_pending = cash_account - (cost.sum() + fees.sum())
+        if funds_to_allocate > 0:
+            if cash_account_pending >= 0:
+                # TRANSACTION GOES THROUGH, OTHERWISE NO ACTION IF NOT ENOUGH CASH TO EXECUTE
+                cash_account = cash_account_pending
+                holdings = current_portfolio
+            else:
+                rejected += 1
+        else:
+            assert cash_account_pending > 0, f"Selling off all stocks should result in positive cash_account, got {cash_account_pending}"
+            cash_account = cash_account_pending
+            holdings = current_portfolio
+
+        # END HOUSE-KEEPING, HOLD UNTIL THE NEXT SIGNAL CHANGE
+        portfolio[day:segment_end] = holdings
+        cash_accounts[day:segment_end] = cash_account
+        trade_count[day] = np.count_nonzero(change_in_portfolio)
+
+    count("rebalance_days", len(rebalance_days))
+    count("rejected_rebalances", rejected)
+    state.update({"cash_account" : cash_account, "holdings" : holdings, "prev_signal" : signals[-1], "prev_close" : closes[-1]})
+    return portfolio, cash_accounts, trade_count
+
+def _format_block(index, columns, portfolio, closes, cash_accounts, trade_count, first_block):
+    """
+    Build the output DataFrames of run_backtest() from the arrays of a block of trading days.
+    On the first block, the first day carries no cash or trade record and is dropped from portfolio_value and trade_count.
+    """
+    cash_accounts = pd.DataFrame(cash_accounts.astype(object), index = index, columns = ["cash"])
+    trade_count = trade_count.astype(object)
+    if first_block:
+        trade_count[0] = np.nan
+    trade_count = pd.DataFrame(trade_count, index = index, columns = ["num_trades"])
+    portfolio_value = pd.DataFrame(portfolio * closes, index = index, columns = columns)
+    portfolio = pd.DataFrame(portfolio, index = index, columns = columns)
+
+    # MERGE CASH HISTORY
+    portfolio_value = pd.concat((portfolio_value, cash_accounts), axis = 1).dropna()
+
+    return portfolio, portfolio_value, trade_count.dropna()
+
+@timed("backtest")
+def run_backtest_array(positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal"):
+    """
+    Conduct backtesting on preallocated NumPy arrays. Rebalancing is only evaluated on days where the signal changes,
+    while the holding days in between are filled in bulk. Outputs are identical to run_backtest().
+
+    Parameters:
+        positions_signals (pd.DataFrame): DataFrame of market signals generated (1: long, 0: no position), shape is (num of trading days, num of instruments).
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+        weights (pd.DataFrame): DataFrame of the weights for portfolio allocation, shape is (num of trading days, num of instruments).
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+
+    Returns:
+        portfolio (pd.DataFrame): DataFrame of the number of open positions (in number of shares) given each day, shape is (num of trading days, num of instruments).
+        portfolio_value (pd.DataFrame): DataFrame of the market closing value of portfolio given each day, shape is (num of trading days, num of instruments).
+        trade_count (pd.DataFrame): DataFrame of the number of trades executed each day, shape is (num of days with trades being executed, 1).
+    """
+    if allocation_method not in ("equal", "hrp", "voladj"):
+        raise ValueError(f"Invalid allocation_method: {allocation_method}")
+    index, columns = positions_signals.index, positions_signals.columns
+    signals, opens, opens_nan, closes, weights = _prepare_block(positions_signals, prices_open, prices_close, weights, allocation_method)
+    state = _new_backtest_state(len(columns))
+    portfolio, cash_accounts, trade_count = _simulate_block(signals, opens, opens_nan, closes, weights, columns, allocation_method, state)
+    return _format_block(index, columns, portfolio, closes, cash_accounts, trade_count, first_block = True)
+
+class BacktestResult:
+    """
+    Compact outputs of a backtest: only the position changes, the cash account on the days it changes, the days with trades,
+    and the daily AUM are stored, in NumPy arrays. The daily portfolio, portfolio_value and trade_count DataFrames of run_backtest()
+    are rebuilt on request. Pass it to calculate_result_metrics() for its metrics.
+
+    Attributes:
+        index (pd.Index): Trading days.
+        columns (pd.Index): Instruments.
+        event_days, event_instruments (np.ndarray): Day and instrument (int32 positions in index and columns) of each position change,
+            ordered by instrument then day.
+        event_positions (np.ndarray): Number of shares held from each position change on (float64).
+        cash_days, cash_values (np.ndarray): Days the cash account changes (int32) and its value from then on (float64).
+        trade_days, trade_counts (np.ndarray): Days with trades executed and their number of trades (int32).
+        aum (np.ndarray): Total market closing value of the portfolio including cash each day, from the second day (float64).
+        prices_close (pd.DataFrame): Close prices the portfolio is valued at, needed to rebuild portfolio_value. Not serialised.
+    """
+    __slots__ = (
+        "index", "columns", "event_days", "event_instruments", "event_positions",
+        "cash_days", "cash_values", "trade_days", "trade_counts", "aum_values", "prices_close"
+    )
+
+    def __init__(self, index, columns, event_days, event_instruments, event_positions, cash_days, cash_values, trade_days, trade_counts, aum_values, prices_close = None):
+        self.index, self.columns = index, columns
+        self.event_days, self.event_instruments, self.event_positions = event_days, event_instruments, event_positions
+        self.cash_days, self.cash_values = cash_days, cash_values
+        self.trade_days, self.trade_counts = trade_days, trade_counts
+        self.aum_values = aum_values
+        self.prices_close = prices_close
+
+    @classmethod
+    def from_arrays(cls, index, columns, portfolio, closes, cash_accounts, trade_count, prices_close = None):
+        """
+        Compact the arrays of a backtest returned by _simulate_block().
+        """
+        # POSITION CHANGES, AND NON-ZERO POSITIONS ON THE FIRST DAY
+        changed = np.vstack((portfolio[:1] != 0, portfolio[1:] != portfolio[:-1]))
+        event_instruments, event_days = np.nonzero(changed.T)
+        cash_days = np.concatenate(([0], np.flatnonzero(cash_accounts[1:] != cash_accounts[:-1]) + 1))
+        trade_days = np.flatnonzero(trade_count[1:]) + 1
+        # SEQUENTIAL ROW SUMS, AS THE SUM OF THE portfolio_value DataFrame
+        aum_values = np.cumsum(np.column_stack((portfolio * closes, cash_accounts)), axis = 1)[1:, -1]
+        return cls(
+            index, columns, event_days.astype(np.int32), event_instruments.astype(np.int32), portfolio[event_days, event_instruments],
+            cash_days.astype(np.int32), cash_accounts[cash_days], trade_days.astype(np.int32), trade_count[trade_days].astype(np.int32),
+            aum_values, prices_close
+        )
+
+    @property
+    def aum(self):
+        """
+        pd.Series: Total market closing value of the portfolio including cash each day, ie. portfolio_value.sum(axis = 1).
+        """
+        return pd.Series(self.aum_values, index = self.index[1:])
+
+    @property
+    def num_trades(self):
+        """
+        int: Total number of trades executed.
+        """
+        return int(self.trade_counts.sum(dtype = np.int64))
+
+    def transactions(self):
+        """
+        Position changes after the first day, ordered by instrument then day, as found by extract_trades() from the daily portfolio.
+
+        Returns:
+            tuple: (instruments, days, changes in number of shares) arrays.
+        """
+        previous = np.concatenate(([0.], self.event_positions[:-1]))
+        # THE FIRST CHANGE OF EACH INSTRUMENT STARTS FROM NO POSITION
+        previous[np.flatnonzero(np.diff(self.event_instruments, prepend = -1))] = 0
+        after_first = self.event_days > 0
+        changes = self.event_positions - previous
+        return self.event_instruments[after_first].astype(np.intp), self.event_days[after_first].astype(np.intp), changes[after_first]
+
+    def _portfolio_array(self):
+        portfolio = np.full((len(self.index), len(self.columns)), np.nan)
+        portfolio[self.event_days, self.event_instruments] = self.event_positions
+        portfolio[0, np.isnan(portfolio[0])] = 0
+        # CARRY EACH POSITION FORWARD TO THE NEXT CHANGE
+        rows = np.where(np.isnan(portfolio), 0, np.arange(len(self.index))[:, np.newaxis])
+        return portfolio[np.maximum.accumulate(rows, axis = 0), np.arange(len(self.columns))]
+
+    def to_frames(self):
+        """
+        Rebuild the daily outputs of run_backtest().
+
+        Returns:
+            tuple: (portfolio, portfolio_value, trade_count) DataFrames, identical to run_backtest_array().
+        """
+        if self.prices_close is None:
+            raise ValueError("prices_close is required to rebuild portfolio_value, pass it to BacktestResult.load().")
+        days = np.arange(len(self.index))
+        cash_accounts = self.cash_values[np.searchsorted(self.cash_days, days, side = "right") - 1]
+        trade_count = np.zeros(len(self.index), dtype = int)
+        trade_count[self.trade_days] = self.trade_counts
+        closes = self.prices_close.loc[self.index, self.columns].to_numpy(dtype = float)
+        closes[np.isnan(closes)] = 0
+        return _format_block(self.index, self.columns, self._portfolio_array(), closes, cash_accounts, trade_count, first_block = True)
+
+    @property
+    def portfolio(self):
+        """
+        pd.DataFrame: Number of open positions (in number of shares) given each day, rebuilt on each access.
+        """
+        return pd.DataFrame(self._portfolio_array(), index = self.index, columns = self.columns)
+
+    @property
+    def portfolio_value(self):
+        """
+        pd.DataFrame: Market closing value of the portfolio and cash given each day, rebuilt on each access.
+        """
+        return self.to_frames()[1]
+
+    @property
+    def trade_count(self):
+        """
+        pd.DataFrame: Number of trades executed each day, rebuilt on each access.
+        """
+        trade_count = pd.DataFrame(np.zeros(len(self.index) - 1, dtype = int).astype(object), index = self.index[1:], columns = ["num_trades"])
+        trade_count.iloc[self.trade_days - 1, 0] = self.trade_counts.astype(object)
+        return trade_count
+
+    @property
+    def nbytes(self):
+        """
+        int: Memory held by the arrays.
+        """
+        return sum(getattr(self, name).nbytes for name in self.__slots__ if isinstance(getattr(self, name), np.ndarray))
+
+    def __getstate__(self):
+        # THE PRICES ARE SHARED WITH THE CALLER, THEY ARE NOT SENT TO OTHER PROCESSES
+        return {name : getattr(self, name) for name in self.__slots__ if name != "prices_close"}
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state.get(name))
+
+    def save(self, path):
+        """
+        Write the result to a compressed .npz file.
+
+        Parameters:
+            path (str): Path of the file.
+        """
+        np.savez_compressed(
+            path, index = self.index.to_numpy(dtype = "datetime64[ns]"), columns = self.columns.to_numpy(dtype = str),
+            names = np.array([json.dumps(self.index.name), json.dumps(self.columns.name)]),
+            **{name : getattr(self, name) for name in self.__slots__ if name not in ("index", "columns", "prices_close")}
+        )
+
+    @classmethod
+    def load(cls, path, prices_close = None):
+        """
+        Read a result written by save().
+
+        Parameters:
+            path (str): Path of the file.
+            prices_close (pd.DataFrame): Close prices of the backtest, to rebuild portfolio_value.
+
+        Returns:
+            BacktestResult: Result.
+        """
+        with np.load(path) as arrays:
+            arrays = dict(arrays)
+        index_name, columns_name = [json.loads(name) for name in arrays.pop("names")]
+        index, columns = pd.DatetimeIndex(arrays.pop("index"), name = index_name), pd.Index(arrays.pop("columns"), name = columns_name)
+        return cls(index, columns, prices_close = prices_close, **arrays)
+
+@timed("backtest")
+def run_backtest_compact(positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal"):
+    """
+    Conduct backtesting as run_backtest_array(), returning a compact BacktestResult instead of daily DataFrames.
+
+    Parameters:
+        positions_signals (pd.DataFrame): DataFrame of market signals generated (1: long, 0: no position), shape is (num of trading days, num of instruments).
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+        weights (pd.DataFrame): DataFrame of the weights for portfolio allocation, shape is (num of trading days, num of instruments).
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+
+    Returns:
+        BacktestResult: Compact outputs of the backtest.
+    """
+    if allocation_method not in ("equal", "hrp", "voladj"):
+        raise ValueError(f"Invalid allocation_method: {allocation_method}")
+    index, columns = positions_signals.index, positions_signals.columns
+    signals, opens, opens_nan, closes, weights = _prepare_block(positions_signals, prices_open, prices_close, weights, allocation_method)
+    portfolio, cash_accounts, trade_count = _simulate_block(signals, opens, opens_nan, closes, weights, columns, allocation_method, _new_backtest_state(len(columns)))
+    return BacktestResult.from_arrays(index, columns, portfolio, closes, cash_accounts, trade_count, prices_close)
+
+def _next_chunk(source, chunk):
+    """
+    Rows of an input matching a chunk of positions signals: sliced from a DataFrame, or the next item of an iterator of chunks.
+    """
+    if source is None or isinstance(source, pd.DataFrame):
+        return source if source is None else source.loc[chunk.index, :]
+    return next(source)
+
+def iter_backtest(positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal", chunk_size = 2520):
+    """
+    Conduct backtesting block by block of trading days, carrying cash and positions across blocks.
+    Peak memory is set by chunk_size rather than the length of the history. Concatenating the blocks gives the outputs of run_backtest().
+
+    Parameters:
+        positions_signals (pd.DataFrame or iterable of pd.DataFrame): DataFrame of market signals generated (1: long, 0: no position),
+            or an iterable of consecutive chunks of it, eg. loaded from disk one at a time.
+        prices_open (pd.DataFrame or iterable of pd.DataFrame): DataFrame of the market open prices, or an iterable of chunks matching positions_signals.
+        prices_close (pd.DataFrame or iterable of pd.DataFrame): DataFrame of the market close prices, or an iterable of chunks matching positions_signals.
+        weights (pd.DataFrame or iterable of pd.DataFrame): DataFrame of the weights for portfolio allocation, or an iterable of chunks matching positions_signals.
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+        chunk_size (int): Number of trading days per block, when positions_signals is a DataFrame.
+
+    Yields:
+        tuple: (portfolio, portfolio_value, trade_count) DataFrames of each block, as returned by run_backtest().
+    """
+    if allocation_method not in ("equal", "hrp", "voladj"):
+        raise ValueError(f"Invalid allocation_method: {allocation_method}")
+    if isinstance(positions_signals, pd.DataFrame):
+        chunks = (positions_signals.iloc[start:(start + chunk_size)] for start in range(0, len(positions_signals), chunk_size))
+    else:
+        chunks = iter(positions_signals)
+    prices_open, prices_close, weights = [source if source is None or isinstance(source, pd.DataFrame) else iter(source) for source in (prices_open, prices_close, weights)]
+
+    state = None
+    for chunk in chunks:
+        if state is None:
+            state = _new_backtest_state(chunk.shape[1])
+            first_block = True
+        signals, opens, opens_nan, closes, weights_ = _prepare_block(
+            chunk, _next_chunk(prices_open, chunk), _next_chunk(prices_close, chunk), _next_chunk(weights, chunk), allocation_method
+        )
+        portfolio, cash_accounts, trade_count = _simulate_block(signals, opens, opens_nan, closes, weights_, chunk.columns, allocation_method, state)
+        yield _format_block(chunk.index, chunk.columns, portfolio, closes, cash_accounts, trade_count, first_block)
+        first_block = False
+
+@timed("backtest")
+def write_backtest(path, positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal", chunk_size = 2520):
+    """
+    Conduct backtesting block by block with iter_backtest(), appending each block to a columnar store on disk as soon as it is done.
+    Read the results back with read_backtest().
+
+    Parameters:
+        path (str): Directory of the store, see source/price_store.py. Fields are "portfolio", "portfolio_value" and "trade_count".
+        Other parameters: see iter_backtest().
+
+    Returns:
+        int: Number of trading days written.
+    """
+    num_days = 0
+    for portfolio, portfolio_value, trade_count in iter_backtest(positions_signals, prices_open, prices_close, weights, allocation_method, chunk_size):
+        block = pd.concat({
+            "portfolio" : portfolio,
+            "portfolio_value" : portfolio_value.astype(float),
+            "trade_count" : trade_count.astype(float)
+        }, axis = 1)
+        num_days += append_prices(block, path)
+    return num_days
+
+def read_backtest(path, start = None, end = None):
+    """
+    Read the outputs of write_backtest() back from disk. Only the written columns are read, eg. no "cash" column in portfolio.
+
+    Parameters:
+        path (str): Directory of the store written by write_backtest().
+        start (datetime): First trading day to read (inclusive). Default is the first stored day.
+        end (datetime): Last trading day to read (inclusive). Default is the last stored day.
+
+    Returns:
+        tuple: (portfolio, portfolio_value, trade_count) DataFrames, as returned by run_backtest().
+    """
+    portfolio, portfolio_value, trade_count = [
+        load_prices(path, fields = [field], tickers = stored_tickers(path, field), start = start, end = end).loc[:, field].rename_axis(None, axis = 1)
+        for field in ("portfolio", "portfolio_value", "trade_count")
+    ]
+    # THE FIRST DAY OF THE BACKTEST CARRIES NO CASH OR TRADE RECORD
+    portfolio_value = portfolio_value.loc[portfolio_value.loc[:, "cash"].notna(), :].astype({"cash" : object})
+    trade_count = trade_count.dropna().astype(np.int64).astype(object)
+    return portfolio, portfolio_value, trade_count
+
+def _rebalance_batch(cash_accounts, holdings, signals, opens, opens_nan, prev_closes, weights, columns, allocation_method):
+    """
+    Rebalance several strategies with the same allocation method on the same day, stacked as rows. Identical to the rebalancing step of run_backtest_array().
+
+    Parameters:
+        cash_accounts (np.ndarray): Cash account of each strategy, shape is (num of strategies, ).
+        holdings (np.ndarray): Holdings (in number of shares), shape is (num of strategies, num of instruments).
+        signals (np.ndarray): Market signals of the day, shape is (num of strategies, num of instruments).
+        opens, opens_nan (np.ndarray): Market open prices of the day, missing as 0 or NaN, shape is (num of instruments, ).
+        prev_closes (np.ndarray): Market close prices of the previous day of each strategy, shape is (num of strategies, num of instruments).
+        weights (np.ndarray): Weights of the day, shape is (num of strategies, num of instruments). Unused for "equal".
+        columns (pd.Index): Instruments.
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+
+    Returns:
+        tuple: (cash_accounts, holdings, trade_count) after rebalancing.
+    """
+    prev_aum = cash_accounts + (holdings * prev_closes).sum(axis = 1)
+    # SEQUENTIAL SUMS, AS THE BUILT-IN sum()
+    eligible_count = np.cumsum(signals, axis = 1)[:, -1]
+    funds_to_allocate = prev_aum * np.clip(eligible_count * MAX_PROP, 0, 1)
+    allocate = funds_to_allocate > 0
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        funds_to_each = np.where(allocate, funds_to_allocate / eligible_count, 0)[:, np.newaxis]
+        target, order = _target_portfolio(funds_to_each, signals, opens_nan, weights, columns, allocation_method)
+    # SIGNAL CHANGED BUT NOW HOLD NO STOCKS (IE SELL EVERYTHING)
+    target[~allocate] = 0
+
+    change_in_portfolio = target - holdings
+    change_in_portfolio = np.clip(np.abs(change_in_portfolio), MIN_TRANSC, None) * np.sign(change_in_portfolio)
+    cost = change_in_portfolio * opens
+    fees = np.abs(cost) * (COMMISSION_RATE + SLIPPAGE_RATE)
+    if order is not None:
+        order[~allocate] = np.arange(len(columns))
+        cost, fees = np.take_along_axis(cost, order, axis = 1), np.take_along_axis(fees, order, axis = 1)
+    cash_accounts_pending = cash_accounts - (cost.sum(axis = 1) + fees.sum(axis = 1))
+    assert (cash_accounts_pending[~allocate] > 0).all(), f"Selling off all stocks should result in positive cash_account, got {cash_accounts_pending[~allocate]}"
+    # TRANSACTION GOES THROUGH, OTHERWISE NO ACTION IF NOT ENOUGH CASH TO EXECUTE
+    accept = ~allocate | (cash_accounts_pending >= 0)
+    count("rebalance_days", len(accept))
+    count("rejected_rebalances", int((~accept).sum()))
+    cash_accounts = np.where(accept, cash_accounts_pending, cash_accounts)
+    holdings = np.where(accept[:, np.newaxis], target, holdings)
+    return cash_accounts, holdings, np.count_nonzero(change_in_portfolio, axis = 1)
+
+@timed("backtest")
+def run_backtest_batch(strategies, prices_open, prices_close):
+    """
+    Conduct backtesting of several strategies over the same prices in one pass over time. Prices are prepared once and shared,
+    and the strategies rebalancing on the same day are processed together as stacked arrays. Outputs are identical to run_backtest() on each strategy.
+
+    Parameters:
+        strategies (dict): Dictionary with each key being a strategy name, each item a dictionary of the positions_signals, weights (optional)
+            and allocation_method (optional) arguments of run_backtest(). All positions signals must have the same instruments.
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+
+    Returns:
+        dict: Dictionary with each key being a strategy name, each item the (portfolio, portfolio_value, trade_count) tuple returned by run_backtest().
+    """
+    names = list(strategies.keys())
+    specs = [{"weights" : None, "allocation_method" : "equal", **strategies[name]} for name in names]
+    columns = specs[0]["positions_signals"].columns
+    for spec in specs:
+        assert spec["positions_signals"].columns.equals(columns), "All positions signals must have the same instruments."
+        if spec["allocation_method"] not in ("equal", "hrp", "voladj"):
+            raise ValueError(f"Invalid allocation_method: {spec['allocation_method']}")
+        assert spec["allocation_method"] == "equal" or spec["weights"] is not None, f"Weights cannot be None when {spec['allocation_method']} is chosen."
+
+    # SHARED PRICE PREPROCESSING, OVER ALL TRADING DAYS OF ANY STRATEGY
+    index = specs[0]["positions_signals"].index
+    for spec in specs[1:]:
+        if not spec["positions_signals"].index.equals(index):
+            index = index.union(spec["positions_signals"].index)
+    opens = prices_open.loc[index, columns].to_numpy(dtype = float)
+    opens[np.isnan(opens)] = 0
+    closes = prices_close.loc[index, columns].to_numpy(dtype = float)
+    closes[np.isnan(closes)] = 0
+    opens_nan = np.where(opens == 0, np.nan, opens)
+
+    # REBALANCING EVENTS OF ALL STRATEGIES: (DAY, STRATEGY, ROW IN THE STRATEGY'S OWN INDEX)
+    signals, weights, days, events = list(), list(), list(), list()
+    shared_weights = dict()
+    for s, spec in enumerate(specs):
+        signals.append(_signal_array(spec["positions_signals"]))
+        days.append(index.get_indexer(spec["positions_signals"].index))
+        if spec["weights"] is None:
+            weights.append(None)
+        else:
+            # WEIGHT SETS USED BY SEVERAL STRATEGIES ARE ALIGNED ONCE
+            key = (id(spec["weights"]), id(spec["positions_signals"].index))
+            if key not in shared_weights:
+                shared_weights[key] = spec["weights"].reindex(index = spec["positions_signals"].index, columns = columns).to_numpy(dtype = float)
+            weights.append(shared_weights[key])
+        rows = np.flatnonzero(_find_signal_changes(signals[s]))
+        events.append(np.column_stack((days[s][rows], np.full(len(rows), s), rows)))
+    events = np.concatenate(events) if len(events) > 0 else np.empty((0, 3), dtype = int)
+    events = events[np.lexsort((events[:, 1], events[:, 0]))]
+
+    # STACKED STATE OF ALL STRATEGIES, AND THEIR STATE AFTER EACH EVENT
+    cash_accounts = np.full(len(specs), float(CAPITAL_0))
+    holdings = np.zeros((len(specs), len(columns)))
+    event_cash, event_holdings, event_trades = np.empty(len(events)), np.empty((len(events), len(columns))), np.empty(len(events), dtype = int)
+    day_starts = np.flatnonzero(np.diff(events[:, 0], prepend = -1))
+    for start, end in zip(day_starts, np.append(day_starts[1:], len(events))):
+        day = events[start, 0]
+        for allocation_method in ("equal", "hrp", "voladj"):
+            batch = [i for i in range(start, end) if specs[events[i, 1]]["allocation_method"] == allocation_method]
+            if len(batch) == 0:
+                continue
+            strats, rows = events[batch, 1], events[batch, 2]
+            cash_, holdings_, trades_ = _rebalance_batch(
+                cash_accounts[strats], holdings[strats],
+                np.stack([signals[s][r] for s, r in zip(strats, rows)]),
+                opens[day], opens_nan[day],
+                closes[[days[s][r - 1] for s, r in zip(strats, rows)]],
+                None if allocation_method == "equal" else np.stack([weights[s][r] for s, r in zip(strats, rows)]),
+                columns, allocation_method
+            )
+            cash_accounts[strats], holdings[strats] = cash_, holdings_
+            event_cash[batch], event_holdings[batch], event_trades[batch] = cash_, holdings_, trades_
+
+    # OUTPUT, HOLD EACH STRATEGY'S PORTFOLIO UNTIL ITS NEXT EVENT
+    results = dict()
+    by_strategy = np.argsort(events[:, 1], kind = "stable")
+    bounds = np.searchsorted(events[by_strategy, 1], np.arange(len(specs) + 1))
+    for s, name in enumerate(names):
+        events_ = by_strategy[bounds[s]:bounds[s + 1]]
+        num_days = len(days[s])
+        latest = np.searchsorted(events[events_, 2], np.arange(num_days), side = "right") - 1
+        held = latest >= 0
+        portfolio = np.zeros((num_days, len(columns)))
+        portfolio[held] = event_holdings[events_[latest[held]]]
+        cash_ = np.full(num_days, float(CAPITAL_0))
+        cash_[held] = event_cash[events_[latest[held]]]
+        cash_[0] = np.nan
+        trades_ = np.zeros(num_days, dtype = int)
+        trades_[events[events_, 2]] = event_trades[events_]
+        results[name] = _format_block(specs[s]["positions_signals"].index, columns, portfolio, closes[days[s]], cash_, trades_, first_block = True)
+    return results
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import argparse
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+
+from config import BENCHMARK_BASELINE_PATH
+from source.calculate_rsi import calculate_rsi
+from source.calculate_macd import calculate_macd_signal
+from source.generate_positions_rsi import generate_positions_rsi
+from source.generate_positions_macd import generate_positions_macd
+from source.hrp import _HRP_CACHE, calculate_hrp_weights
+from source.voladj import calculate_voladj_weights
+from source.backtest import run_backtest, run_backtest_array
+from source.metrics import calculate_portfolio_metrics
+
+STAGES = [
+    "calculate_rsi (sma)", "calculate_rsi (ema)", "calculate_macd_signal",
+    "generate_positions_rsi", "generate_positions_macd",
+    "calculate_hrp_weights", "calculate_voladj_weights",
+    "run_backtest (equal)", "run_backtest (hrp)", "run_backtest (voladj)",
+    "run_backtest_array (equal)", "run_backtest_array (hrp)", "run_backtest_array (voladj)",
+    "calculate_portfolio_metrics"
+]
+
+def make_synthetic_prices(num_tickers = 7, num_days = 2520, ragged = True, gap_rate = 0., seed = 0):
+    """
+    Generate a synthetic panel of daily OHLC prices following geometric Brownian motions, to benchmark without a connection.
+
+    Parameters:
+        num_tickers (int): Number of instruments.
+        num_days (int): Number of trading days.
+        ragged (bool): Set to True for ragged histories: the first instrument trades throughout, the others list in the first half
+            of the history (as META and TSLA do), and a quarter of them are delisted in the second half.
+        gap_rate (float): Probability of a price being missing on any given day, eg. trading halts.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        pd.DataFrame: Price data indexed by date, with two-level columns (field, ticker) as returned by yf.download().
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range("1980-01-01", periods = num_days, name = "Date")
+    tickers = [f"T{i:04d}" for i in range(num_tickers)]
+    returns = rng.normal(.0004, .02, (num_days, num_tickers))
+    close = 20 * np.exp(np.cumsum(returns, axis = 0))
+    open_ = np.vstack((close[:1], close[:-1])) * np.exp(rng.normal(0, .005, (num_days, num_tickers)))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, .005, (num_days, num_tickers))))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, .005, (num_days, num_tickers))))
+
+    missing = rng.random((num_days, num_tickers)) < gap_rate
+    if ragged:
+        rows = np.arange(num_days)[:, np.newaxis]
+        listing = rng.integers(0, num_days // 2, num_tickers)
+        listing[0] = 0
+        delisting = np.where(rng.random(num_tickers) < .25, rng.integers(num_days // 2, num_days, num_tickers), num_days)
+        delisting[0] = num_days
+        missing |= (rows < listing) | (rows >= delisting)
+    fields = {"Close" : close, "High" : high, "Low" : low, "Open" : open_}
+    return pd.concat({field : pd.DataFrame(np.where(missing, np.nan, values), index = index, columns = tickers) for field, values in fields.items()}, axis = 1)
+
+def _hrp_weights(prices_close):
+    """
+    Calculate HRP weights from scratch, clearing the in-memory cache of optimised windows left by a previous run.
+    """
+    _HRP_CACHE.clear()
+    return calculate_hrp_weights.uncached(prices_close, 50)
+
+def _measure(func, repeat, trace_memory):
+    """
+    Time a function, and optionally trace its peak memory in a separate run.
+
+    Returns:
+        tuple: (output of func, best wall-clock time in seconds, peak memory allocated in bytes or NaN).
+    """
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        seconds = min(seconds, time.perf_counter() - start)
+    peak = np.nan
+    if trace_memory:
+        # SEPARATE RUN, TRACING SLOWS DOWN ALLOCATIONS
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return output, seconds, peak
+
+def run_benchmarks(sizes, stages = None, ragged = True, gap_rate = 0., seed = 0, repeat = 1, trace_memory = True):
+    """
+    Time each stage of the pipeline on synthetic prices of growing sizes. The disk cache is bypassed.
+
+    Parameters:
+        sizes (list of tuple): (num of tickers, num of trading days) of each synthetic panel.
+        stages (list of str): Stages to run, see STAGES. Default is all stages. Inputs of the stages left out are still computed, untimed.
+        ragged (bool): Ragged histories, see make_synthetic_prices().
+        gap_rate (float): Probability of a missing price, see make_synthetic_prices().
+        seed (int): Seed of the random number generator.
+        repeat (int): Number of timed runs of each stage, the best is reported.
+        trace_memory (bool): Set to True to also record the peak memory of each stage.
+
+    Returns:
+        pd.DataFrame: One row per stage and size, with the wall-clock time in seconds and peak memory in MB.
+    """
+    stages = STAGES if stages is None else stages
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if len(unknown) > 0:
+        raise ValueError(f"Invalid stages: {unknown}")
+    records = list()
+    for num_tickers, num_days in sizes:
+        prices = make_synthetic_prices(num_tickers, num_days, ragged, gap_rate, seed)
+        prices_close, prices_open = prices.loc[:, "Close"], prices.loc[:, "Open"]
+        outputs = dict()
+
+        def stage(name, func):
+            if name in stages:
+                outputs[name], seconds, peak = _measure(func, repeat, trace_memory)
+                records.append({"stage" : name, "num_tickers" : num_tickers, "num_days" : num_days, "seconds" : seconds, "peak_mb" : peak / 1024 ** 2})
+            elif name not in outputs:
+                outputs[name] = func()
+            return outputs[name]
+
+        rsi_close = stage("calculate_rsi (sma)", lambda : calculate_rsi.uncached(prices_close, "sma", 14))
+        stage("calculate_rsi (ema)", lambda : calculate_rsi.uncached(prices_close, "ema", 14))
+        macd_signal = stage("calculate_macd_signal", lambda : calculate_macd_signal.uncached(prices_close))
+        positions_rsi = stage("generate_positions_rsi", lambda : generate_positions_rsi(rsi_close, 25, 75).astype(float).fillna(0))
+        positions_macd = stage("generate_positions_macd", lambda : generate_positions_macd(macd_signal, rsi_close, (25, 50), (80, 100)))
+        weights = {
+            "equal" : None,
+            "hrp" : stage("calculate_hrp_weights", lambda : _hrp_weights(prices_close)) if any("hrp" in name for name in stages) else None,
+            "voladj" : stage("calculate_voladj_weights", lambda : calculate_voladj_weights.uncached(prices_close, 50))
+        }
+        for func in (run_backtest, run_backtest_array):
+            for allocation_method, weights_ in weights.items():
+                name = f"{func.__name__} ({allocation_method})"
+                positions = positions_rsi if allocation_method == "equal" else positions_macd
+                if name in stages:
+                    stage(name, lambda : func(positions, prices_open, prices_close, weights_, allocation_method))
+        if "calculate_portfolio_metrics" in stages:
+            portfolio, portfolio_value, trade_count = run_backtest_array(positions_rsi, prices_open, prices_close)
+            aum = portfolio_value.sum(axis = 1)
+            stage("calculate_portfolio_metrics", lambda : calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open))
+    return pd.DataFrame(records, columns = ["stage", "num_tickers", "num_days", "seconds", "peak_mb"])
+
+def save_baseline(results, path = BENCHMARK_BASELINE_PATH):
+    """
+    Store benchmark results as the baseline to compare against.
+
+    Parameters:
+        results (pd.DataFrame): Output of run_benchmarks().
+        path (str): Path of the baseline JSON file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok = True)
+    with open(path, "w") as f:
+        json.dump(results.to_dict(orient = "records"), f, indent = 1)
+
+def compare_to_baseline(results, path = BENCHMARK_BASELINE_PATH, tolerance = .25, min_seconds = .01, min_mb = 1.):
+    """
+    Compare benchmark results to the stored baseline, flagging regressions.
+
+    Parameters:
+        results (pd.DataFrame): Output of run_benchmarks().
+        path (str): Path of the baseline JSON file.
+        tolerance (float): Relative increase in time or peak memory over the baseline flagged as a regression.
+        min_seconds (float): Increases in time below this are treated as noise.
+        min_mb (float): Increases in peak memory below this are treated as noise.
+
+    Returns:
+        pd.DataFrame: results with the baseline time and peak memory, their ratios, and the regression flags.
+            Stages and sizes missing from the baseline are not flagged.
+    """
+    with open(path) as f:
+        baseline = pd.DataFrame(json.load(f))
+    keys = ["stage", "num_tickers", "num_days"]
+    comparison = results.merge(baseline.loc[:, keys + ["seconds", "peak_mb"]], how = "left", on = keys, suffixes = ("", "_baseline"))
+    comparison["time_ratio"] = comparison.loc[:, "seconds"] / comparison.loc[:, "seconds_baseline"]
+    comparison["memory_ratio"] = comparison.loc[:, "peak_mb"] / comparison.loc[:, "peak_mb_baseline"]
+    comparison["time_regression"] = (comparison.loc[:, "time_ratio"] > 1 + tolerance) & (comparison.loc[:, "seconds"] - comparison.loc[:, "seconds_baseline"] > min_seconds)
+    comparison["memory_regression"] = (comparison.loc[:, "memory_ratio"] > 1 + tolerance) & (comparison.loc[:, "peak_mb"] - comparison.loc[:, "peak_mb_baseline"] > min_mb)
+    return comparison
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark each pipeline stage on synthetic prices.")
+    parser.add_argument("--sizes", nargs = "+", default = ["7x2520", "50x5000"], help = "Sizes as num_tickers x num_days, eg. 7x2520.")
+    parser.add_argument("--stages", nargs = "+", default = None, help = "Stages to run. Default is all stages.")
+    parser.add_argument("--gap-rate", type = float, default = 0.)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 1)
+    parser.add_argument("--baseline", default = BENCHMARK_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action = "store_true", help = "Store the results as the new baseline.")
+    args = parser.parse_args()
+
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes]
+    results = run_benchmarks(sizes, args.stages, gap_rate = args.gap_rate, seed = args.seed, repeat = args.repeat)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(results.to_string(index = False))
+    elif os.path.isfile(args.baseline):
+        comparison = compare_to_baseline(results, args.baseline)
+        print(comparison.to_string(index = False))
+        if (comparison.loc[:, "time_regression"] | comparison.loc[:, "memory_regression"]).any():
+            raise SystemExit("Regressions against the baseline found.")
+    else:
+        print(results.to_string(index = False))
@@ -0,0 +1,128 @@
+import pandas as pd
+import numpy as np
+
+from config import CAPITAL_0, RISK_FREE_RATE, BUSINESS_DAYS
+
+RETURN_METRICS = ["Total Return", "Annualised Return", "Annualised Volatility", "Maximum Drawdown", "Sharpe Ratio", "Sortino Ratio"]
+TRADE_METRICS = ["Win Rate", "Expectancy"]
+
+def _block_indices(rng, num_resamples, num_days, block_size):
+    """
+    Draw the days of circular block bootstrap resamples: blocks of block_size consecutive days, wrapping around the end.
+
+    Returns:
+        np.ndarray: Indices of the resampled days, shape is (num_resamples, num_days).
+    """
+    num_blocks = -(-num_days // block_size)
+    starts = rng.integers(0, num_days, (num_resamples, num_blocks))
+    indices = (starts[:, :, np.newaxis] + np.arange(block_size)) % num_days
+    return indices.reshape(num_resamples, -1)[:, :num_days]
+
+def _return_metrics(daily_returns, aum_0):
+    """
+    Calculate the metrics of calculate_portfolio_metrics() based on daily returns, for many samples at once.
+
+    Parameters:
+        daily_returns (np.ndarray): Daily returns, one sample per row, shape is (num of samples, num of trading days).
+        aum_0 (float): Asset Under Management before the first return.
+
+    Returns:
+        dict of np.ndarray: Metrics, each of shape (num of samples, ).
+    """
+    aum = aum_0 * np.cumprod(1 + daily_returns, axis = 1)
+    drawdowns = aum / np.maximum(np.maximum.accumulate(aum, axis = 1), aum_0) - 1
+    excess_daily_returns = daily_returns - (RISK_FREE_RATE / 252)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return {
+            "Total Return" : (aum[:, -1] - CAPITAL_0) / CAPITAL_0,
+            "Annualised Return" : (1 + daily_returns.mean(axis = 1)) ** BUSINESS_DAYS - 1,
+            "Annualised Volatility" : daily_returns.std(axis = 1, ddof = 1) * np.sqrt(BUSINESS_DAYS),
+            "Maximum Drawdown" : np.abs(np.minimum(drawdowns.min(axis = 1), 0)),
+            "Sharpe Ratio" : np.sqrt(BUSINESS_DAYS) * excess_daily_returns.mean(axis = 1) / excess_daily_returns.std(axis = 1, ddof = 1),
+            "Sortino Ratio" : np.sqrt(BUSINESS_DAYS) * excess_daily_returns.mean(axis = 1) / np.minimum(excess_daily_returns, 0).std(axis = 1, ddof = 1)
+        }
+
+def _trade_metrics(profits):
+    """
+    Calculate the win rate and expectancy of calculate_portfolio_metrics() based on trade profits, for many samples at once.
+
+    Parameters:
+        profits (np.ndarray): Profit/loss of each trade, one sample per row, shape is (num of samples, num of trades).
+
+    Returns:
+        dict of np.ndarray: Metrics, each of shape (num of samples, ). NaN if there are no trades.
+    """
+    if profits.shape[1] == 0:
+        # NO TRADES TO RESAMPLE
+        return {metric : np.full(len(profits), np.nan) for metric in TRADE_METRICS}
+    wins, losses = profits > 0, profits < 0
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        win_rate = wins.mean(axis = 1)
+        avg_win = np.where(wins, profits, 0).sum(axis = 1) / wins.sum(axis = 1)
+        avg_lose = np.where(losses, profits, 0).sum(axis = 1) / losses.sum(axis = 1)
+    return {
+        "Win Rate" : win_rate,
+        "Expectancy" : win_rate * avg_win - (1 - win_rate) * np.abs(avg_lose)
+    }
+
+def bootstrap_metrics(aum, trades = None, num_resamples = 10000, block_size = 20, confidence = .95, seed = 0, batch_size = 500, return_samples = False):
+    """
+    Bootstrap confidence intervals of the portfolio metrics. Daily returns are resampled in blocks of consecutive days (circular block bootstrap),
+    to keep their autocorrelation and volatility clustering, and trade profits are resampled individually. All resamples of a batch are evaluated as one array.
+
+    Parameters:
+        aum (pd.Series or pd.DataFrame): Total value of Asset Under Management daily, shape is (num of trading days, ).
+            A DataFrame with one strategy per column resamples the same days for every strategy, so their metrics can be compared pairwise.
+        trades (pd.DataFrame or dict of pd.DataFrame): Trades returned by extract_trades() (metadata["trades"] of calculate_portfolio_metrics()),
+            or a dictionary with each key being a column of aum. None to skip the win rate and expectancy.
+        num_resamples (int): Number of bootstrap resamples.
+        block_size (int): Number of consecutive days in each block.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the random number generator.
+        batch_size (int): Number of resamples evaluated at once. Bounds peak memory.
+        return_samples (bool): Set to True to also return the metrics of every resample.
+
+    Returns:
+        intervals (pd.DataFrame): One row per metric (and strategy, if aum is a DataFrame), with the estimate on the original sample,
+            the lower and upper bounds of the interval, and the standard error.
+        samples (pd.DataFrame): Metrics of every resample, only if return_samples is True.
+    """
+    aum = aum.to_frame() if isinstance(aum, pd.Series) else aum
+    if isinstance(trades, pd.DataFrame):
+        trades = {aum.columns[0] : trades}
+    daily_returns = aum.astype(float).pct_change().iloc[1:].to_numpy()
+    aum_0 = aum.iloc[0].astype(float).to_numpy()
+    num_days = len(daily_returns)
+    rng = np.random.default_rng(seed)
+
+    samples = {col : {metric : list() for metric in RETURN_METRICS} for col in aum.columns}
+    for start in range(0, num_resamples, batch_size):
+        size = min(batch_size, num_resamples - start)
+        # THE SAME DAYS FOR EVERY STRATEGY
+        indices = _block_indices(rng, size, num_days, block_size)
+        for j, col in enumerate(aum.columns):
+            for metric, values in _return_metrics(daily_returns[indices, j], aum_0[j]).items():
+                samples[col][metric].append(values)
+            if trades is not None and col in trades:
+                profits = trades[col].loc[:, "profit"].to_numpy()
+                for metric, values in _trade_metrics(profits[rng.integers(0, len(profits), (size, len(profits)))]).items():
+                    samples[col].setdefault(metric, list()).append(values)
+
+    rows, sample_frames = list(), dict()
+    alpha = (1 - confidence) / 2
+    for j, col in enumerate(aum.columns):
+        estimates = _return_metrics(daily_returns[np.newaxis, :, j], aum_0[j])
+        if trades is not None and col in trades:
+            estimates.update(_trade_metrics(trades[col].loc[:, "profit"].to_numpy()[np.newaxis]))
+        sample_frames[col] = pd.DataFrame({metric : np.concatenate(values) for metric, values in samples[col].items()})
+        for metric, values in sample_frames[col].items():
+            lower, upper = np.nanquantile(values, [alpha, 1 - alpha]) if values.notna().any() else (np.nan, np.nan)
+            rows.append({"strategy" : col, "metric" : metric, "estimate" : estimates[metric][0], "lower" : lower, "upper" : upper, "std" : values.std()})
+
+    intervals = pd.DataFrame(rows).set_index(["strategy", "metric"])
+    if aum.shape[1] == 1:
+        intervals = intervals.droplevel("strategy")
+    if not return_samples:
+        return intervals
+    samples = pd.concat(sample_frames, axis = 1, names = ["strategy", "metric"])
+    return intervals, samples.droplevel("strategy", axis = 1) if aum.shape[1] == 1 else samples
@@ -0,0 +1,169 @@
+import os
+import sys
+import hashlib
+import inspect
+import functools
+
+import pandas as pd
+import numpy as np
+
+from config import CACHE_ENABLED, CACHE_PATH, CACHE_MAX_BYTES
+from source.instrumentation import count
+
+# HIT/MISS STATISTICS OF THE CURRENT PROCESS
+_STATS = {"hits" : 0, "misses" : 0, "evictions" : 0}
+
+def fingerprint(obj):
+    """
+    Compute a content fingerprint of a function argument.
+
+    Parameters:
+        obj: pd.DataFrame, pd.Series, pd.Index, np.ndarray or any object with a deterministic repr().
+
+    Returns:
+        str: Hex digest identifying the content of obj.
+    """
+    digest = hashlib.sha256()
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        digest.update(type(obj).__name__.encode())
+        digest.update(pd.util.hash_pandas_object(obj, index = not isinstance(obj, pd.Index)).to_numpy().tobytes())
+        if isinstance(obj, pd.DataFrame):
+            # HASHING IS ROW-WISE, SO ALSO IDENTIFY THE COLUMNS AND THEIR TYPES
+            digest.update(repr((obj.columns.tolist(), obj.dtypes.astype(str).tolist())).encode())
+        else:
+            digest.update(repr((obj.name, str(obj.dtype))).encode())
+    elif isinstance(obj, np.ndarray):
+        digest.update(repr((obj.shape, str(obj.dtype))).encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    else:
+        digest.update(repr(obj).encode())
+    return digest.hexdigest()
+
+def _evict(path, max_bytes):
+    """
+    Delete the least recently used entries until the cache fits in max_bytes.
+
+    Parameters:
+        path (str): Directory of the cache.
+        max_bytes (int): Maximum total size of the cache entries.
+    """
+    entries = list()
+    for entry in os.scandir(path):
+        if entry.name.endswith(".pkl"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # EVICTED BY ANOTHER PROCESS MEANWHILE
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in entries:
+        if total <= max_bytes:
+            break
+        total -= size
+        try:
+            os.remove(entry_path)
+            _STATS["evictions"] += 1
+        except FileNotFoundError:
+            continue
+
+def _source_hash(func):
+    """
+    Fingerprint of the source code of the module of a function and of every source.* module it depends on, directly or not.
+    """
+    modules, pending = dict(), [sys.modules[func.__module__]]
+    while len(pending) > 0:
+        module = pending.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+        for obj in vars(module).values():
+            # IMPORTED MODULES, AND FUNCTIONS AND CLASSES IMPORTED FROM MODULES
+            name = obj.__name__ if inspect.ismodule(obj) else getattr(obj, "__module__", None)
+            if isinstance(name, str) and name.startswith("source.") and name in sys.modules:
+                pending.append(sys.modules[name])
+    digest = hashlib.sha256()
+    for name in sorted(modules):
+        with open(inspect.getsourcefile(modules[name]), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def disk_cache(ignore = ()):
+    """
+    Decorator storing the outputs of a function on disk, keyed by a fingerprint of its arguments and of the source code
+    of its module and of the source.* modules it depends on, so editing any of them invalidates its entries.
+    Entries are evicted least recently used first once the cache exceeds CACHE_MAX_BYTES.
+
+    Parameters:
+        ignore (tuple of str): Names of arguments that do not affect the output, eg. number of worker processes.
+
+    Returns:
+        callable: Decorator. The undecorated function is available as the uncached attribute.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        # HASHED ON THE FIRST CALL, ONCE THE DEPENDENCIES OF THE MODULE ARE IMPORTED
+        source_hash = list()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return func(*args, **kwargs)
+            if len(source_hash) == 0:
+                source_hash.append(_source_hash(func))
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = hashlib.sha256(repr((
+                func.__module__, func.__qualname__, source_hash[0],
+                [(name, fingerprint(value)) for name, value in arguments.arguments.items() if name not in ignore]
+            )).encode()).hexdigest()
+            entry_path = os.path.join(CACHE_PATH, f"{func.__name__}-{key}.pkl")
+            try:
+                # MARK AS RECENTLY USED
+                os.utime(entry_path)
+                result = pd.read_pickle(entry_path)
+            except FileNotFoundError:
+                # NOT CACHED, OR EVICTED BY ANOTHER PROCESS MEANWHILE
+                pass
+            else:
+                _STATS["hits"] += 1
+                count("cache_hits")
+                return result
+            _STATS["misses"] += 1
+            count("cache_misses")
+            result = func(*args, **kwargs)
+            os.makedirs(CACHE_PATH, exist_ok = True)
+            # WRITE-THEN-RENAME, SO CONCURRENT READERS NEVER SEE A PARTIAL ENTRY
+            tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+            pd.to_pickle(result, tmp_path)
+            os.replace(tmp_path, entry_path)
+            _evict(CACHE_PATH, CACHE_MAX_BYTES)
+            return result
+
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+def cache_stats():
+    """
+    Report the cache usage.
+
+    Returns:
+        dict: Hits, misses and evictions of the current process, and the number and total size of the entries on disk.
+    """
+    entries = [entry for entry in os.scandir(CACHE_PATH) if entry.name.endswith(".pkl")] if os.path.isdir(CACHE_PATH) else list()
+    return {
+        **_STATS,
+        "entries" : len(entries),
+        "bytes" : sum(entry.stat().st_size for entry in entries)
+    }
+
+def clear_cache():
+    """
+    Delete all entries of the cache.
+    """
+    if os.path.isdir(CACHE_PATH):
+        for entry in os.scandir(CACHE_PATH):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
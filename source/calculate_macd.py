@@ -1,26 +1,20 @@
-import ta
+import pandas as pd
+import numpy as np
 
-def _get_macd_signal(series):
-    """
-    Calculate the MACD-based entry signal (enter at crossover) for a pandas Series.
-
-    Parameters:
-        series (pd.Series): Input data series (e.g., closing prices).
-        period (int): Lookback period for RSI calculation. Default is 14.
+from source.cache import disk_cache
+from source.instrumentation import timed
 
-    Returns:
-        pd.Series: MACD signals.
+def _ema(prices, span):
     """
-    macd = ta.trend.macd_diff(series).dropna()
-    macd[macd >= 0] = 1
-    macd[macd < 0] = 0
-    macd = macd.diff()
-    return macd.dropna()
-
+    Exponential moving average as used by ta.trend.macd_diff().
+    """
+    return prices.ewm(span = span, min_periods = span, adjust = False).mean()
 
+@timed("indicators")
+@disk_cache()
 def calculate_macd_signal(prices):
     """
-    Calculate the MACD-based entry signal (enter at crossover) for a pandas DataFrame.
+    Calculate the MACD-based entry signal (enter at crossover) for a pandas DataFrame, all instruments at once.
 
     Parameters:
         prices (pd.DataFrame): Input price dataframe, each instrument as a column.
@@ -28,7 +22,13 @@ def calculate_macd_signal(prices):
     Returns:
         pd.DataFrame: DataFrame of MACD signals.
     """
-
-    macd_df = prices.apply(lambda ser : _get_macd_signal(ser), axis = 0)
-
-    return macd_df
\ No newline at end of file
+    # MACD DIFFERENCE, AS ta.trend.macd_diff()
+    prices = prices.astype(float)
+    macd = _ema(prices, 12) - _ema(prices, 26)
+    macd_diff = (macd - _ema(macd, 9)).to_numpy()
+    side = np.where(np.isnan(macd_diff), np.nan, (macd_diff >= 0).astype(float))
+    # CHANGE FROM THE PREVIOUS AVAILABLE VALUE OF EACH INSTRUMENT
+    prev_side = pd.DataFrame(side).ffill().shift().to_numpy()
+    macd_df = pd.DataFrame(side - prev_side, index = prices.index, columns = prices.columns)
+    # KEEP DAYS WITH AT LEAST ONE SIGNAL
+    return macd_df.loc[macd_df.notna().any(axis = 1), :]
@@ -1,18 +1,46 @@
-import ta
+import pandas as pd
+import numpy as np
 
-def _get_rsi_sma(series, period):
+from source.cache import disk_cache
+from source.instrumentation import timed
+
+def _pack_columns(values):
     """
-    Calculate the Relative Strength Index (RSI) for a pandas Series using Simple MA.
+    Move the non-missing values of each column to the top, keeping their order, as if each column was dropna()-ed.
 
     Parameters:
-        series (pd.Series): Input data series (e.g., closing prices).
+        values (np.ndarray): Values, shape is (num of trading days, num of instruments).
+
+    Returns:
+        packed (np.ndarray): Packed values, NaN after the last value of each column.
+        order (np.ndarray): Original row of each packed value, for _unpack_columns().
+        counts (np.ndarray): Number of non-missing values of each column.
+    """
+    missing = np.isnan(values)
+    order = np.argsort(missing, axis = 0, kind = "stable")
+    return np.take_along_axis(values, order, axis = 0), order, (~missing).sum(axis = 0)
+
+def _unpack_columns(packed, order):
+    """
+    Move packed values back to their original rows, inverse of _pack_columns().
+    """
+    values = np.empty_like(packed)
+    np.put_along_axis(values, order, packed, axis = 0)
+    return values
+
+def _get_rsi_sma(prices, period):
+    """
+    Calculate the Relative Strength Index (RSI) for packed prices using Simple MA.
+
+    Parameters:
+        prices (pd.DataFrame): Packed input data (e.g., closing prices), each instrument as a column.
         period (int): Lookback period for RSI calculation. Default is 14.
 
     Returns:
-        pd.Series: RSI values.
+        pd.DataFrame: RSI values.
     """
     # Calculate price changes
-    delta = series.diff()
+    delta = prices.diff()
 
     # Separate gains and losses
     gains = delta.where(delta > 0, 0)
@@ -29,26 +57,33 @@ def _get_rsi_sma(series, period):
     rs = avg_gains / avg_losses
 
     # Calculate the RSI
-    rsi = 100 - (100 / (1 + rs))
-
-    return rsi.iloc[(period - 1):]
+    return 100 - (100 / (1 + rs))
 
-def _get_rsi_ema(series, period):
+def _get_rsi_ema(prices, period):
     """
-    Calculate the Relative Strength Index (RSI) for a pandas Series using Exponential MA.
+    Calculate the Relative Strength Index (RSI) for packed prices using Exponential MA, as ta.momentum.rsi().
 
     Parameters:
-        series (pd.Series): Input data series (e.g., closing prices).
+        prices (pd.DataFrame): Packed input data (e.g., closing prices), each instrument as a column.
         period (int): Lookback period for RSI calculation. Default is 14.
 
     Returns:
-        pd.Series: RSI values.
+        pd.DataFrame: RSI values.
     """
-    return ta.momentum.rsi(series, window = period).iloc[(period - 1):]
+    delta = prices.diff()
+    gains = delta.where(delta > 0, 0.0)
+    losses = -delta.where(delta < 0, 0.0)
+    avg_gains = gains.ewm(alpha = 1 / period, min_periods = period, adjust = False).mean()
+    avg_losses = losses.ewm(alpha = 1 / period, min_periods = period, adjust = False).mean()
+    rs = avg_gains / avg_losses
+    return pd.DataFrame(np.where(avg_losses == 0, 100, 100 - (100 / (1 + rs))), index = prices.index, columns = prices.columns)
 
+@timed("indicators")
+@disk_cache()
 def calculate_rsi(prices, smoothing = "sma", period = 14):
     """
-    Calculate the Relative Strength Index (RSI) for a pandas DataFrame.
+    Calculate the Relative Strength Index (RSI) for a pandas DataFrame. Missing prices are skipped for each instrument,
+    and all instruments are processed at once, so ragged listing dates do not need a pass per instrument.
 
     Parameters:
         prices (pd.DataFrame): Input price dataframe, each instrument as a column.
@@ -60,9 +95,16 @@ def calculate_rsi(prices, smoothing = "sma", period = 14):
     """
     match smoothing:
         case "sma":
-            rsi_df = prices.apply(lambda ser : _get_rsi_sma(ser.dropna(), period), axis = 0)
+            get_rsi = _get_rsi_sma
         case "ema":
-            rsi_df = prices.apply(lambda ser : _get_rsi_ema(ser.dropna(), period), axis = 0)
+            get_rsi = _get_rsi_ema
         case _:
             raise NotImplementedError(f"{smoothing} is not a valid smoothing parameter.")
-    return rsi_df
\ No newline at end of file
+    packed, order, counts = _pack_columns(prices.to_numpy(dtype = float))
+    rsi = get_rsi(pd.DataFrame(packed, columns = prices.columns), period).to_numpy()
+    # NO RSI UNTIL period PRICES, OR AFTER THE LAST PRICE
+    rows = np.arange(len(rsi))[:, np.newaxis]
+    rsi[(rows < period - 1) | (rows >= counts)] = np.nan
+    rsi = pd.DataFrame(_unpack_columns(rsi, order), index = prices.index, columns = prices.columns)
+    # KEEP DAYS WITH AT LEAST ONE RSI VALUE
+    return rsi.loc[rsi.notna().any(axis = 1), :]
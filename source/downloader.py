@@ -0,0 +1,352 @@
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit, urlencode, parse_qs, quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from config import LIST_OF_STOCKS, PRICE_STORE_PATH, PRICE_SOURCE_URL
+from source.price_store import stored_dates, last_stored_date, update_prices
+from source.instrumentation import timed, count
+
+# HTTP STATUSES WORTH RETRYING: RATE LIMITED OR SERVER ERRORS
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class _ConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections to one host, reused across requests.
+
+    Parameters:
+        url (str): Base URL of the requests, eg. PRICE_SOURCE_URL.
+        timeout (float): Seconds allowed for each request.
+    """
+    def __init__(self, url, timeout = 30.):
+        parts = urlsplit(url)
+        self.host, self.ssl = parts.hostname, parts.scheme == "https"
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._idle = list()
+
+    async def _read_body(self, reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = list()
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # SKIP TRAILERS UNTIL THE BLANK LINE
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        return await reader.read()
+
+    async def _request(self, reader, writer, path):
+        writer.write((
+            f"GET {self.base_path}{path} HTTP/1.1\r\nHost: {self.host}\r\nUser-Agent: Mozilla/5.0\r\n"
+            "Accept: application/json\r\nConnection: keep-alive\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server.")
+        status = int(status_line.split()[1])
+        headers = dict()
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return status, headers, await self._read_body(reader, headers)
+
+    async def get(self, path):
+        """
+        Send a GET request on an idle connection, or a new one.
+
+        Parameters:
+            path (str): Path and query string, appended to the base URL.
+
+        Returns:
+            tuple: (HTTP status, body bytes).
+        """
+        if self._idle:
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl = self.ssl or None), self.timeout)
+        try:
+            status, headers, body = await asyncio.wait_for(self._request(reader, writer, path), self.timeout)
+        except BaseException:
+            # THE CONNECTION IS IN AN UNKNOWN STATE, DO NOT REUSE IT
+            writer.close()
+            raise
+        if headers.get("connection", "").lower() == "close" or "content-length" not in headers and "transfer-encoding" not in headers:
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        return status, body
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+def _parse_chart(body, ticker):
+    """
+    Convert a chart response of the yahoo finance API into auto-adjusted daily prices, as yf.download(auto_adjust = True) does.
+
+    Parameters:
+        body (bytes): JSON body of the response.
+        ticker (str): Ticker requested.
+
+    Returns:
+        pd.DataFrame: Price data indexed by date, with two-level columns (field, ticker) as returned by yf.download().
+    """
+    result = json.loads(body)["chart"]["result"][0]
+    columns = pd.MultiIndex.from_product([["Close", "High", "Low", "Open", "Volume"], [ticker]], names = ["Price", "Ticker"])
+    if not result.get("timestamp"):
+        return pd.DataFrame(columns = columns, index = pd.DatetimeIndex([], name = "Date"), dtype = float)
+    timezone = result.get("meta", dict()).get("exchangeTimezoneName", "UTC")
+    index = pd.to_datetime(result["timestamp"], unit = "s", utc = True).tz_convert(timezone).tz_localize(None).normalize().rename("Date")
+    quote_ = {field : np.array(values, dtype = float) for field, values in result["indicators"]["quote"][0].items()}
+    adjclose = result["indicators"].get("adjclose", [{"adjclose" : quote_["close"]}])[0]["adjclose"]
+    ratio = np.array(adjclose, dtype = float) / quote_["close"]
+    values = np.column_stack((quote_["close"] * ratio, quote_["high"] * ratio, quote_["low"] * ratio, quote_["open"] * ratio, quote_["volume"]))
+    prices = pd.DataFrame(values, index = index, columns = columns)
+    # ONE ROW PER DAY, THE LAST QUOTE OF A DAY WINS (EG. A LIVE QUOTE DURING THE SESSION)
+    return prices.loc[~prices.index.duplicated(keep = "last") & prices.notna().any(axis = 1), :]
+
+async def _download_ticker(pool, semaphore, ticker, start, end, retries, backoff):
+    """
+    Download the prices of one ticker from start (inclusive) to end, retrying failures with exponential backoff and jitter.
+
+    Returns:
+        tuple: (ticker, prices or None if failed, number of attempts, error or None).
+    """
+    query = urlencode({"period1" : int(start.timestamp()), "period2" : int(end.timestamp()), "interval" : "1d", "events" : "div,splits"})
+    for attempt in range(1, retries + 2):
+        try:
+            async with semaphore:
+                status, body = await pool.get(f"/{quote(ticker, safe = '')}?{query}")
+            if status == 200:
+                return ticker, _parse_chart(body, ticker), attempt, None
+            if status not in _RETRY_STATUSES:
+                # EG. UNKNOWN TICKER, RETRYING WOULD NOT HELP
+                return ticker, None, attempt, f"HTTP {status}"
+            error = f"HTTP {status}"
+        except (ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as error_:
+            error = repr(error_)
+        except (ValueError, KeyError, IndexError, TypeError) as error_:
+            return ticker, None, attempt, f"Invalid response: {error_!r}"
+        if attempt <= retries:
+            count("download_retries")
+            await asyncio.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random()))
+    return ticker, None, attempt, error
+
+async def download_prices_async(tickers = LIST_OF_STOCKS, path = PRICE_STORE_PATH, url = PRICE_SOURCE_URL, concurrency = 8, batch_size = 100,
+                                retries = 4, backoff = .5, timeout = 30., end = None):
+    """
+    Coroutine of download_prices(), to run within an existing event loop.
+    """
+    end = pd.Timestamp.now(tz = "UTC").floor("D") + pd.Timedelta(days = 1) if end is None else pd.Timestamp(end)
+    end = end.tz_localize("UTC") if end.tz is None else end.tz_convert("UTC")
+    pool, semaphore = _ConnectionPool(url, timeout), asyncio.Semaphore(concurrency)
+    # ONE WRITER THREAD: WRITES ARE SEQUENTIAL, WHILE THE EVENT LOOP KEEPS RECEIVING
+    writer = ThreadPoolExecutor(max_workers = 1)
+    loop = asyncio.get_running_loop()
+    records = list()
+    try:
+        for batch_start in range(0, len(tickers), batch_size):
+            downloads = list()
+            for ticker in tickers[batch_start:(batch_start + batch_size)]:
+                # ONLY THE DAYS AFTER THE LAST STORED PRICE, OR THE FULL HISTORY OF A NEW TICKER
+                last = last_stored_date(path, ticker)
+                start = pd.Timestamp(0, tz = "UTC") if last is None else last.tz_localize("UTC") + pd.Timedelta(days = 1)
+                if start >= end:
+                    records.append({"ticker" : ticker, "status" : "up to date", "days" : 0, "attempts" : 0, "error" : None})
+                else:
+                    downloads.append(_download_ticker(pool, semaphore, ticker, start, end, retries, backoff))
+            # WRITE EACH TICKER TO THE STORE AS SOON AS IT ARRIVES, EXCEPT THOSE WITH DAYS THE STORE LACKS (EG. AN EARLIER LISTING),
+            # WHICH REWRITE THE STORE AND ARE WRITTEN TOGETHER AT THE END OF THE BATCH
+            pending, writes = list(), list()
+            for download in asyncio.as_completed(downloads):
+                ticker, prices, attempts, error = await download
+                if prices is not None and len(prices) > 0:
+                    stored = await loop.run_in_executor(writer, stored_dates, path)
+                    if len(stored) > 0 and (~prices.index[prices.index < stored[-1]].isin(stored)).any():
+                        pending.append(prices)
+                    else:
+                        writes.append(loop.run_in_executor(writer, update_prices, prices, path))
+                records.append({
+                    "ticker" : ticker, "status" : "failed" if prices is None else "downloaded",
+                    "days" : 0 if prices is None else len(prices), "attempts" : attempts, "error" : error
+                })
+                count("download_failures" if prices is None else "tickers_downloaded")
+            if len(pending) > 0:
+                writes.append(loop.run_in_executor(writer, update_prices, pd.concat(pending, axis = 1), path))
+            # RAISE ANY WRITE ERROR BEFORE THE NEXT BATCH
+            await asyncio.gather(*writes)
+    finally:
+        pool.close()
+        writer.shutdown(wait = True)
+    return pd.DataFrame(records, columns = ["ticker", "status", "days", "attempts", "error"]).set_index("ticker")
+
+@timed("read")
+def download_prices(tickers = LIST_OF_STOCKS, path = PRICE_STORE_PATH, url = PRICE_SOURCE_URL, concurrency = 8, batch_size = 100,
+                    retries = 4, backoff = .5, timeout = 30., end = None):
+    """
+    Download daily prices into the price store, concurrently over pooled keep-alive connections. Each ticker only requests the days
+    after its last stored price (its full history if new), is retried with exponential backoff on timeouts, connection errors,
+    rate limiting and server errors, and is written to the store as soon as it arrives, so a failure loses no other ticker.
+
+    Parameters:
+        tickers (list of str): Tickers to download.
+        path (str): Directory of the price store.
+        url (str): Base URL of a server with the yahoo finance chart API, eg. serve_synthetic_prices().url for testing offline.
+        concurrency (int): Maximum number of requests in flight.
+        batch_size (int): Number of tickers scheduled at once. Bounds the memory of pending downloads.
+        retries (int): Number of retries of each ticker.
+        backoff (float): Seconds before the first retry, doubled on each retry (plus up to 100% random jitter).
+        timeout (float): Seconds allowed for each request.
+        end (datetime): Day (exclusive) the downloads end, in UTC if timezone-naive. Default is tomorrow (UTC).
+
+    Returns:
+        pd.DataFrame: One row per ticker with its "status" ("downloaded", "up to date" or "failed"), number of "days" downloaded,
+            number of "attempts" and last "error".
+    """
+    coroutine = download_prices_async(tickers, path, url, concurrency, batch_size, retries, backoff, timeout, end)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # ALREADY IN AN EVENT LOOP (EG. JUPYTER), RUN IN A THREAD OF ITS OWN
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+class _SyntheticPriceHandler(BaseHTTPRequestHandler):
+    """
+    Serve synthetic daily price histories with the yahoo finance chart API: GET /<ticker>?period1=<unix seconds>&period2=<unix seconds>.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        ticker = parts.path.strip("/").split("/")[-1]
+        query = {name : values[0] for name, values in parse_qs(parts.query).items()}
+        with server.lock:
+            failed = server.rng.random() < server.fail_rate
+        if failed:
+            return self._send(503, b'{"error" : "Service Unavailable"}')
+        if ticker in server.missing:
+            return self._send(404, b'{"chart" : {"result" : null, "error" : {"code" : "Not Found"}}}')
+        if server.delay > 0:
+            time.sleep(server.delay)
+        prices = server.history(ticker)
+        start = pd.Timestamp(int(query.get("period1", 0)), unit = "s")
+        end = pd.Timestamp(int(query.get("period2", 2 ** 31)), unit = "s")
+        prices = prices.loc[(prices.index >= start.normalize()) & (prices.index < end), :]
+        # TIMESTAMPS OF THE MARKET OPEN, 9:30 NEW YORK TIME
+        timestamps = (prices.index + pd.Timedelta(hours = 14, minutes = 30)).asi8 // 10 ** 9
+        quote_ = {field.lower() : prices.loc[:, field].round(6).tolist() for field in ("Open", "High", "Low", "Close", "Volume")}
+        body = {"chart" : {"result" : [{
+            "meta" : {"symbol" : ticker, "exchangeTimezoneName" : "UTC"},
+            "timestamp" : timestamps.tolist(),
+            "indicators" : {"quote" : [quote_], "adjclose" : [{"adjclose" : quote_["close"]}]}
+        }], "error" : None}}
+        self._send(200, json.dumps(body).encode())
+
+def _synthetic_history(ticker, num_days, seed):
+    """
+    Daily OHLCV prices of a ticker following a geometric Brownian motion, from 1980-01-01. Deterministic for a ticker and seed,
+    and a longer history extends a shorter one, so that incremental downloads can be tested.
+    """
+    rng = np.random.default_rng([zlib.crc32(ticker.encode()), seed])
+    draws = rng.normal(size = (num_days, 4))
+    close = 20 * np.exp(np.cumsum(.0004 + .02 * draws[:, 0]))
+    open_ = np.concatenate(([20.], close[:-1])) * np.exp(.005 * draws[:, 1])
+    high = np.maximum(open_, close) * np.exp(.005 * np.abs(draws[:, 2]))
+    low = np.minimum(open_, close) * np.exp(-.005 * np.abs(draws[:, 3]))
+    volume = np.round(1e6 * np.exp(.5 * draws[:, 2]))
+    index = pd.bdate_range("1980-01-01", periods = num_days, name = "Date")
+    # LISTED AT DIFFERENT DAYS OF THE FIRST YEAR, FOR RAGGED HISTORIES
+    listing = zlib.crc32(ticker.encode()) % 250
+    return pd.DataFrame({"Open" : open_, "High" : high, "Low" : low, "Close" : close, "Volume" : volume}, index = index).iloc[listing:]
+
+def serve_synthetic_prices(host = "127.0.0.1", port = 0, num_days = 11000, seed = 0, fail_rate = 0., delay = 0., missing = ()):
+    """
+    Start a local stand-in of the yahoo finance chart API serving synthetic price histories, to test downloads without a connection.
+    The server runs in a background thread until server.shutdown() is called.
+
+    Parameters:
+        host (str): Address to listen on.
+        port (int): Port to listen on. Default is any free port.
+        num_days (int): Number of trading days of each history, from 1980-01-01. Serve again with more days to test incremental downloads.
+        seed (int): Seed of the histories.
+        fail_rate (float): Probability of a request failing with HTTP 503, to test retries.
+        delay (float): Seconds added to each response, to test concurrency.
+        missing (list of str): Tickers answered with HTTP 404.
+
+    Returns:
+        ThreadingHTTPServer: Server, with its base URL as the url attribute.
+    """
+    server = ThreadingHTTPServer((host, port), _SyntheticPriceHandler)
+    server.daemon_threads = True
+    server.lock, server.rng = threading.Lock(), random.Random(seed)
+    server.fail_rate, server.delay, server.missing = fail_rate, delay, set(missing)
+    histories = dict()
+
+    def history(ticker):
+        with server.lock:
+            if ticker not in histories:
+                histories[ticker] = _synthetic_history(ticker, num_days, seed)
+            return histories[ticker]
+
+    server.history = history
+    server.url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Download daily prices into the price store, or serve synthetic prices locally.")
+    parser.add_argument("tickers", nargs = "*", default = LIST_OF_STOCKS)
+    parser.add_argument("--store", default = PRICE_STORE_PATH)
+    parser.add_argument("--url", default = PRICE_SOURCE_URL)
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--retries", type = int, default = 4)
+    parser.add_argument("--serve", action = "store_true", help = "Serve synthetic prices on --port instead of downloading.")
+    parser.add_argument("--port", type = int, default = 8765)
+    args = parser.parse_args()
+
+    if args.serve:
+        server = serve_synthetic_prices(port = args.port)
+        print(f"Serving synthetic prices on {server.url}, press Ctrl+C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+    else:
+        summary = download_prices(args.tickers, args.store, args.url, args.concurrency, retries = args.retries)
+        print(summary.to_string())
+        if (summary.loc[:, "status"] == "failed").any():
+            raise SystemExit("Some tickers failed to download.")
@@ -0,0 +1,393 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import config
+from config import EXPERIMENTS_PATH
+from source.read_data import read_data
+from source.calculate_rsi import calculate_rsi
+from source.calculate_macd import calculate_macd_signal
+from source.generate_positions_rsi import generate_positions_rsi
+from source.generate_positions_macd import generate_positions_macd
+from source.hrp import calculate_hrp_weights
+from source.voladj import calculate_voladj_weights
+from source.rolling import RollingStats
+from source.backtest import run_backtest_compact, BacktestResult
+from source.metrics import calculate_result_metrics
+from source.walk_forward import _PANELS, _share_panels, _attach_panels
+
+# PARAMETERS OF EACH STRATEGY AND THEIR DEFAULTS, AS IN THE NOTEBOOKS. A NONE RSI PERIOD IS THE RSI_PERIOD OF THE CONFIG, RESOLVED BY expand_runs()
+_MACD_PARAMS = {"rsi_method" : "sma", "rsi_period" : None, "entry_rsi_range" : (25, 50), "exit_rsi_range" : (80, 100)}
+STRATEGIES = {
+    "rsi" : {"rsi_method" : "sma", "rsi_period" : None, "buy_level" : 25, "sell_level" : 75, "exit_rsi" : None},
+    "macd" : _MACD_PARAMS,
+    "hrp" : {**_MACD_PARAMS, "rolling" : 50},
+    "voladj" : {**_MACD_PARAMS, "window" : 50}
+}
+# WEIGHTS OF EACH ALLOCATION STRATEGY, AND THE PARAMETER THEY DEPEND ON
+_WEIGHTS = {"hrp" : (calculate_hrp_weights, "rolling"), "voladj" : (calculate_voladj_weights, "window")}
+
+# VALUES OF config.py AN EXPERIMENT CAN OVERRIDE: THOSE OF THE BACKTEST AND METRICS, ALSO PER RUN,
+# AND THOSE OF THE DATA, LOADED ONCE PER EXPERIMENT
+_RUN_CONFIG = ("CAPITAL_0", "COMMISSION_RATE", "SLIPPAGE_RATE", "MIN_TRANSC", "MAX_PROP", "RISK_FREE_RATE", "BUSINESS_DAYS")
+_DATA_CONFIG = ("LIST_OF_STOCKS", "BACKTEST_START", "BACKTEST_END", "RSI_PERIOD", "PRICE_STORE_PATH")
+
+# INDICATORS OF THE CURRENT PROCESS, SHARED BY THE RUNS OF A WORKER
+_INDICATORS = dict()
+
+def load_spec(path):
+    """
+    Read and validate an experiment spec, a JSON file such as:
+        {
+            "name" : "macd-grid",
+            "strategy" : "hrp",
+            "grid" : {"entry_rsi_range" : [[20, 45], [25, 50]], "rolling" : [50, 100], "COMMISSION_RATE" : [0.001, 0.002]},
+            "config" : {"MAX_PROP" : 0.25},
+            "data" : {"use_backup" : true}
+        }
+    The config may override the values of the backtest and metrics (eg. COMMISSION_RATE) and of the data (eg. LIST_OF_STOCKS, BACKTEST_START),
+    the grid only those of the backtest and metrics.
+
+    Parameters:
+        path (str): Path of the spec.
+
+    Returns:
+        dict: Experiment spec, with keys "name", "strategy", "grid", "config" and "data".
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    spec.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    spec.setdefault("grid", dict())
+    spec.setdefault("config", dict())
+    spec.setdefault("data", dict())
+    if spec.get("strategy") not in STRATEGIES:
+        raise ValueError(f"Invalid strategy: {spec.get('strategy')}")
+    unknown = [name for name in spec["config"] if name not in _RUN_CONFIG + _DATA_CONFIG]
+    unknown += [name for name in spec["grid"] if name not in _RUN_CONFIG and name not in STRATEGIES[spec["strategy"]]]
+    if len(unknown) > 0:
+        raise ValueError(f"Invalid parameters: {unknown}")
+    return spec
+
+def expand_runs(spec):
+    """
+    List the runs of an experiment: one per combination of the parameter grid.
+
+    Parameters:
+        spec (dict): Experiment spec, see load_spec().
+
+    Returns:
+        list of dict: Runs, with keys "run_id" (a fingerprint of the strategy, parameters, config and data), "params" and "config".
+    """
+    defaults = STRATEGIES[spec["strategy"]]
+    runs = list()
+    for values in itertools.product(*spec["grid"].values()):
+        combination = dict(zip(spec["grid"].keys(), values))
+        # JSON HAS NO TUPLES, RANGES ARE READ AS LISTS
+        params = {**defaults, **{name : tuple(value) if isinstance(value, list) else value for name, value in combination.items() if name in defaults}}
+        if params["rsi_period"] is None:
+            # DEFAULT PERIOD OF THE EXPERIMENT, NOT THE ONE OF config.py AT IMPORT
+            params["rsi_period"] = spec["config"].get("RSI_PERIOD", config.RSI_PERIOD)
+        overrides = {**spec["config"], **{name : value for name, value in combination.items() if name not in defaults}}
+        key = json.dumps({"strategy" : spec["strategy"], "params" : params, "config" : overrides, "data" : spec["data"]}, sort_keys = True, default = str)
+        runs.append({"run_id" : hashlib.sha1(key.encode()).hexdigest()[:16], "params" : params, "config" : overrides})
+    return runs
+
+def _config_modules(name):
+    """
+    Modules holding a value of config.py: config itself and every module that imported it.
+    """
+    modules = [module for module_name, module in list(sys.modules.items()) if module_name.startswith("source.")]
+    # ONLY NAMES BOUND TO THE CONFIG VALUE ITSELF, NOT UNRELATED ATTRIBUTES OF THE SAME NAME
+    return [config] + [module for module in modules if getattr(module, name, None) is getattr(config, name)]
+
+def _config_value(name, value):
+    """
+    Convert an override read from JSON to the type of the config value, ie. dates from ISO strings.
+    """
+    return datetime.fromisoformat(value) if isinstance(getattr(config, name), datetime) else value
+
+@contextmanager
+def _override_config(overrides):
+    """
+    Temporarily replace values of config.py, see _config_modules().
+    """
+    previous = list()
+    try:
+        for name, value in overrides.items():
+            for module in _config_modules(name):
+                previous.append((module, name, getattr(module, name)))
+                setattr(module, name, _config_value(name, value))
+        yield
+    finally:
+        for module, name, value in reversed(previous):
+            setattr(module, name, value)
+
+def _indicator(func, *args):
+    """
+    Compute an indicator of the price panels once per process.
+    """
+    key = (func.__name__, ) + args
+    if key not in _INDICATORS:
+        _INDICATORS[key] = func(_PANELS["prices_close"], *args)
+    return _INDICATORS[key]
+
+def _positions(strategy, params):
+    """
+    Generate the positions signals of a run from the panels of the current process.
+    """
+    rsi_close = _indicator(calculate_rsi, params["rsi_method"], params["rsi_period"])
+    if strategy == "rsi":
+        return generate_positions_rsi(rsi_close, params["buy_level"], params["sell_level"], params["exit_rsi"]).astype(float).fillna(0)
+    return generate_positions_macd(_indicator(calculate_macd_signal), rsi_close, params["entry_rsi_range"], params["exit_rsi_range"])
+
+def _rebalance_dates(strategy, runs):
+    """
+    Days on which any of the runs changes its positions signal, ie. the only days its weights are read.
+    """
+    dates = pd.DatetimeIndex([])
+    for run in runs:
+        positions_signals = _positions(strategy, run["params"])
+        previous = positions_signals.shift()
+        changed = positions_signals.ne(previous) & ~(positions_signals.isna() & previous.isna())
+        dates = dates.union(positions_signals.index[changed.any(axis = 1)])
+    return dates
+
+def _run(strategy, params, overrides):
+    """
+    Backtest one run on the panels of the current process, and calculate its metrics.
+
+    Returns:
+        tuple: (metrics, BacktestResult, seconds).
+    """
+    start = time.perf_counter()
+    positions_signals = _positions(strategy, params)
+    weights, allocation_method = None, "equal"
+    if strategy in _WEIGHTS:
+        weights, allocation_method = _PANELS[f"weights_{params[_WEIGHTS[strategy][1]]}"], strategy
+    with _override_config(overrides):
+        result = run_backtest_compact(positions_signals, _PANELS["prices_open"], _PANELS["prices_close"], weights, allocation_method)
+        metrics, _ = calculate_result_metrics(result, _PANELS["prices_open"])
+    metrics = {name : float(value) for name, value in metrics.items()}
+    return metrics, result, time.perf_counter() - start
+
+def _run_many(strategy, runs):
+    """
+    Backtest several runs, one task of the process pool.
+    """
+    return [(run["run_id"], *_run(strategy, run["params"], run["config"])) for run in runs]
+
+def _init_worker(specs, overrides):
+    """
+    Worker initialiser: attach the shared price panels and apply the config of the experiment.
+    """
+    _attach_panels(specs)
+    for name, value in overrides.items():
+        for module in _config_modules(name):
+            setattr(module, name, _config_value(name, value))
+
+def _weights_panels(strategy, runs, prices_close):
+    """
+    Calculate the weights of the runs of an allocation strategy, once per value of their parameter, to share with the workers.
+    HRP weights are only optimised on the days one of the runs rebalances. Needs the prices in the panels of the current process.
+
+    Returns:
+        dict: Dictionary with each key being a panel name, eg. "weights_50", each item the weights.
+    """
+    if strategy not in _WEIGHTS:
+        return dict()
+    func, param = _WEIGHTS[strategy]
+    # RETURNS COMPUTED ONCE FOR ALL VALUES, RELEASED ON RETURN
+    stats = RollingStats(prices_close)
+    panels = dict()
+    for value in dict.fromkeys(run["params"][param] for run in runs):
+        kwargs = {"stats" : stats}
+        if strategy == "hrp":
+            kwargs["rebalance_dates"] = _rebalance_dates(strategy, [run for run in runs if run["params"][param] == value])
+        panels[f"weights_{value}"] = func(prices_close, value, **kwargs)
+    return panels
+
+def _load_prices(data):
+    """
+    Load the close and open prices of an experiment. Run within the config overrides of the experiment.
+
+    Parameters:
+        data (dict): "data" of the spec: {"use_backup" : bool, "tickers" : list of str} to read the price store (and download missing days unless use_backup),
+            or {"synthetic" : {"num_tickers" : int, "num_days" : int, "seed" : int}} for synthetic prices, see make_synthetic_prices().
+            Default tickers are LIST_OF_STOCKS.
+
+    Returns:
+        tuple: Tuple of two dataframes (prices_close, prices_open).
+    """
+    if "synthetic" in data:
+        from source.benchmark import make_synthetic_prices
+        prices = make_synthetic_prices(**data["synthetic"])
+        return prices.loc[:, "Close"], prices.loc[:, "Open"]
+    # TICKERS ARE PASSED EXPLICITLY, THE DEFAULT OF read_data() IS BOUND AT IMPORT
+    return read_data(use_backup = data.get("use_backup", True), tickers = data.get("tickers", config.LIST_OF_STOCKS))
+
+def completed_runs(store_path):
+    """
+    Identifiers of the runs already stored.
+
+    Parameters:
+        store_path (str): Directory of the results store.
+
+    Returns:
+        set of str: Run identifiers.
+    """
+    return set(record["run_id"] for record in _read_records(store_path))
+
+def _read_records(store_path):
+    path = os.path.join(store_path, "runs.jsonl")
+    if not os.path.isfile(path):
+        return list()
+    records = list()
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # LINE CUT SHORT BY A CRASH, THE RUN IS REDONE
+                continue
+    return records
+
+def _truncate_partial_record(store_path):
+    """
+    Remove a last record cut short by a crash, so the next records start on a new line.
+    """
+    path = os.path.join(store_path, "runs.jsonl")
+    if not os.path.isfile(path):
+        return
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+def _store_result(store_path, run, metrics, result, seconds):
+    """
+    Persist one finished run: its outputs first, then its record, so a recorded run always has its outputs.
+    """
+    output_path = os.path.join(store_path, "outputs", f"{run['run_id']}.npz")
+    tmp_path = f"{output_path}.tmp.npz"
+    result.save(tmp_path)
+    os.replace(tmp_path, output_path)
+    record = {
+        "run_id" : run["run_id"], "params" : run["params"], "config" : run["config"], "metrics" : metrics,
+        "seconds" : seconds, "finished_at" : datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(store_path, "runs.jsonl"), "a") as f:
+        f.write(json.dumps(record, default = str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def run_experiment(spec, store_path = None, n_jobs = 1, chunk_size = 16, verbose = False):
+    """
+    Run every combination of the parameter grid of an experiment, and persist each result as it finishes:
+    metrics and parameters in runs.jsonl, and the compact BacktestResult in outputs/<run_id>.npz.
+    Runs already in the store are skipped, so an interrupted experiment resumes where it stopped.
+
+    Parameters:
+        spec (dict): Experiment spec, see load_spec().
+        store_path (str): Directory of the results store. Default is EXPERIMENTS_PATH/<name of the experiment>.
+        n_jobs (int): Number of worker processes. Default is 1, ie. no process pool.
+        chunk_size (int): Number of runs per task of the process pool.
+        verbose (bool): Set to True to print the progress.
+
+    Returns:
+        pd.DataFrame: Results of every run of the store, see load_results().
+    """
+    store_path = os.path.join(EXPERIMENTS_PATH, spec["name"]) if store_path is None else store_path
+    os.makedirs(os.path.join(store_path, "outputs"), exist_ok = True)
+    with open(os.path.join(store_path, "spec.json"), "w") as f:
+        json.dump(spec, f, indent = 4)
+    _truncate_partial_record(store_path)
+    done = completed_runs(store_path)
+    runs = [run for run in expand_runs(spec) if run["run_id"] not in done]
+    runs = list({run["run_id"] : run for run in runs}.values())
+    if verbose:
+        print(f"{len(runs)} runs to do, {len(done)} already stored.")
+    if len(runs) == 0:
+        return load_results(store_path)
+
+    with _override_config(spec["config"]):
+        prices_close, prices_open = _load_prices(spec["data"])
+    runs_by_id = {run["run_id"] : run for run in runs}
+    chunks = [runs[start:(start + chunk_size)] for start in range(0, len(runs), chunk_size)]
+
+    blocks, pool = list(), None
+    try:
+        _INDICATORS.clear()
+        _PANELS.clear()
+        _PANELS.update({"prices_open" : prices_open, "prices_close" : prices_close})
+        # WEIGHTS ARE CALCULATED ONCE HERE, NOT IN EVERY WORKER
+        _PANELS.update(_weights_panels(spec["strategy"], runs, prices_close))
+        if n_jobs > 1:
+            blocks, specs = _share_panels(_PANELS)
+            pool = ProcessPoolExecutor(max_workers = n_jobs, initializer = _init_worker, initargs = (specs, spec["config"]))
+            results = (result for future in as_completed([pool.submit(_run_many, spec["strategy"], chunk) for chunk in chunks]) for result in future.result())
+        else:
+            results = (result for chunk in chunks for result in _run_many(spec["strategy"], chunk))
+        with _override_config(spec["config"]):
+            for i, (run_id, metrics, result, seconds) in enumerate(results):
+                _store_result(store_path, runs_by_id[run_id], metrics, result, seconds)
+                if verbose:
+                    print(f"[{i + 1}/{len(runs)}] {run_id} {seconds:.2f}s")
+    finally:
+        _INDICATORS.clear()
+        _PANELS.clear()
+        if pool is not None:
+            pool.shutdown(cancel_futures = True)
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return load_results(store_path)
+
+def load_results(store_path):
+    """
+    Load the results of an experiment as one table.
+
+    Parameters:
+        store_path (str): Directory of the results store.
+
+    Returns:
+        pd.DataFrame: One row per run, with flattened columns eg. "params.buy_level", "config.COMMISSION_RATE", "metrics.Sharpe Ratio".
+    """
+    records = _read_records(store_path)
+    if len(records) == 0:
+        return pd.DataFrame(index = pd.Index(list(), name = "run_id"))
+    results = pd.json_normalize(records).set_index("run_id")
+    return results.loc[~results.index.duplicated(keep = "last"), :]
+
+def load_outputs(store_path, run_id, prices_close = None):
+    """
+    Load the compact outputs of a run.
+
+    Parameters:
+        store_path (str): Directory of the results store.
+        run_id (str): Identifier of the run.
+        prices_close (pd.DataFrame): Close prices of the experiment, to rebuild the daily portfolio_value.
+
+    Returns:
+        BacktestResult: Outputs of the backtest, eg. its aum and trade_count.
+    """
+    return BacktestResult.load(os.path.join(store_path, "outputs", f"{run_id}.npz"), prices_close)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run the parameter grid of an experiment spec, resuming from the results store.")
+    parser.add_argument("spec", help = "Path of the JSON experiment spec.")
+    parser.add_argument("--store", default = None, help = "Directory of the results store. Default is EXPERIMENTS_PATH/<name>.")
+    parser.add_argument("--n-jobs", type = int, default = 1)
+    parser.add_argument("--chunk-size", type = int, default = 16)
+    args = parser.parse_args()
+
+    results = run_experiment(load_spec(args.spec), args.store, args.n_jobs, args.chunk_size, verbose = True)
+    print(results.filter(like = "metrics.").describe().T.to_string())
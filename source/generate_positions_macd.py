@@ -1,50 +1,44 @@
 import pandas as pd
+import numpy as np
 
-def _generate_position_signal_macd(macd_signal, rsi_series, entry_rsi_range = (25, 50), exit_rsi_range = (75, 100)):
+from source.state_machine import latch_positions
+from source.instrumentation import timed
+
+def _generate_position_signal_macd(macd_signal, rsi, entry_rsi_range = (25, 50), exit_rsi_range = (75, 100), axis = 0):
     """
-    Generate position indicator. Logic employed:
+    Generate position indicator for all instruments at once. Logic employed:
         - Entry is allowed when MACD difference crosses over zero.
         - When this happens, if RSI is between entry_rsi_range, we will enter a long position.
         - When RSI is between exit_rsi_range, we will exit this position.
 
     Parameters:
-        rsi_series (pd.Series): RSI time series values.
-        exit_rsi (float): RSI points from BUY/SELL signal to exit existing position. eg. if BUY_SIGNAL is 25 and exit_rsi is 30 then close long position when RSI > 55.
-        allow_shorts (bool): Set to True to allow holding negative positions.
+        macd_signal (np.ndarray): MACD signal values, shape is (num of trading days, num of instruments).
+        rsi (np.ndarray): RSI values aligned to macd_signal, shape is (num of trading days, num of instruments).
+        entry_rsi_range (tuple): RSI range (exclusive) to enter a long position on a MACD crossover.
+        exit_rsi_range (tuple): RSI range (exclusive) to exit an existing long position.
+        axis (int): Time axis of the arrays. Range bounds may be arrays broadcastable against rsi to evaluate several ranges at once.
 
     Returns:
-        pd.Series: Positioning 1 indicating an open long position, -1 indicating an open short position, 0 indicating no position.
+        np.ndarray: Positioning 1 indicating an open long position, 0 indicating no position.
     """
-    position_series = list()
-    position = 0
-    for date in macd_signal.index:
-        if macd_signal.loc[date] > 0 and rsi_series.loc[date] > entry_rsi_range[0] and rsi_series.loc[date] < entry_rsi_range[1]:
-            # ENTRY
-            position = 1
-        elif position == 1 and rsi_series.loc[date] > exit_rsi_range[0] and rsi_series.loc[date] < exit_rsi_range[1]:
-            # EXIT
-            position = 0
-        else:
-            # No change to position
-            None
- 
-        position_series.append(position)
-    position_series = pd.Series(position_series, index = macd_signal.index)
-    return position_series
+    entries = (macd_signal > 0) & (rsi > entry_rsi_range[0]) & (rsi < entry_rsi_range[1])
+    exits = (rsi > exit_rsi_range[0]) & (rsi < exit_rsi_range[1])
+    return latch_positions(entries, exits, axis = axis)
 
+@timed("positions")
 def generate_positions_macd(macd_close, rsi_close, entry_rsi_range = (25, 50), exit_rsi_range = (75, 100)):
     """
-    Generate position indicator given dataframe of RSI.
+    Generate position indicator given dataframe of MACD signals and RSI.
 
     Parameters:
+        macd_close (pd.DataFrame): All MACD signal values.
         rsi_close (pd.DataFrame): All RSI time series values.
-        exit_rsi (float): RSI points from BUY/SELL signal to exit existing position. eg. if BUY_SIGNAL is 25 and exit_rsi is 30 then close long position when RSI > 55.
+        entry_rsi_range (tuple): RSI range (exclusive) to enter a long position on a MACD crossover.
+        exit_rsi_range (tuple): RSI range (exclusive) to exit an existing long position.
 
     Returns:
-        pd.DataFrame: Positioning 1 indicating an open long position, -1 indicating an open short position, 0 indicating no position.
+        pd.DataFrame: Positioning 1 indicating an open long position, 0 indicating no position.
     """
-    position_signal = pd.DataFrame(0, index = macd_close.index, columns = macd_close.columns)
-    for col in macd_close.columns:
-        series = _generate_position_signal_macd(macd_close.loc[:, col], rsi_close.loc[:, col], entry_rsi_range, exit_rsi_range)
-        position_signal.loc[:, col] = series
-    return position_signal
\ No newline at end of file
+    rsi = rsi_close.loc[macd_close.index, macd_close.columns].to_numpy(dtype = float)
+    positions = _generate_position_signal_macd(macd_close.to_numpy(dtype = float), rsi, entry_rsi_range, exit_rsi_range)
+    return pd.DataFrame(positions.astype(np.int64), index = macd_close.index, columns = macd_close.columns)
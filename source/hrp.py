@@ -1,25 +1,152 @@
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
-import riskfolio as rp
-
-def calculate_hrp_weights(prices_close, rolling = 50):
-    weights = pd.concat([prices_close.apply(lambda x: 1 / len(x.dropna()), axis = 1)] * prices_close.shape[1], axis = 1)
-    weights.columns = prices_close.columns
-    weights[prices_close.isna()] = pd.NA
-    for date in prices_close.iloc[rolling:, :].index:
-        pos = np.where(prices_close.index == date)[0][0]
-        prices_ = prices_close.iloc[(pos - rolling):pos].dropna(axis = 1)
-        if prices_.shape[1] > 1:
-            # if more than 1 price is available
-            returns = prices_.pct_change().dropna()
-            # Building the portfolio object
-            port = rp.HCPortfolio(returns = returns)
-            # Estimate optimal portfolio:
-            w = port.optimization(model = "HRP", codependence = "pearson", rm = "MV", rf = 0, linkage = "single", max_k = 10, leaf_order = True)
-
-            for col in w.T:
-                weights.loc[date, col] = w.loc[col, "weights"]
-        else:
-            # if only 1 price available
-            weights.loc[date, prices_.columns[0]] = 1
-    return weights
\ No newline at end of file
+
+from source.cache import disk_cache
+from source.instrumentation import timed, count
+from source.rolling import RollingStats
+
+# IN-MEMORY LRU CACHE OF HRP WEIGHTS, KEYED BY THE INSTRUMENTS AND RETURNS OF A WINDOW
+_HRP_CACHE = OrderedDict()
+_HRP_CACHE_SIZE = 4096
+
+def _optimise_hrp(returns, cov):
+    """
+    Estimate the HRP portfolio of a single window.
+
+    Parameters:
+        returns (pd.DataFrame): Returns of the window, each instrument as a column.
+        cov (pd.DataFrame): Covariance matrix of the returns.
+
+    Returns:
+        np.ndarray: HRP weights, in the column order of returns.
+    """
+    # RISKFOLIO IS ONLY IMPORTED ONCE HRP IS USED, IT PULLS IN THE CVXPY AND SCIPY STACKS
+    import riskfolio as rp
+    # Building the portfolio object
+    port = rp.HCPortfolio(returns = returns)
+    # Estimate optimal portfolio, correlation is derived from the covariance (pearson)
+    w = port.optimization(
+        model = "HRP", codependence = "custom_cov", method_cov = "custom_cov", custom_cov = cov,
+        rm = "MV", rf = 0, linkage = "single", max_k = 10, leaf_order = True
+    )
+    return w.loc[returns.columns, "weights"].to_numpy()
+
+def _run_optimisations(tasks, pool, n_jobs):
+    """
+    Run HRP optimisations not found in the cache, and store their results in the cache.
+
+    Parameters:
+        tasks (dict): Dictionary with each key being a cache key, each item a tuple of (returns, cov).
+        pool (ProcessPoolExecutor): Process pool running the optimisations, None to run them in the current process.
+        n_jobs (int): Number of worker processes of the pool.
+
+    Returns:
+        dict: Dictionary with each key being a cache key, each item the HRP weights.
+    """
+    count("hrp_optimisations", len(tasks))
+    if pool is not None and len(tasks) > 1:
+        results = list(pool.map(_optimise_hrp, *zip(*tasks.values()), chunksize = max(1, len(tasks) // (4 * n_jobs))))
+    else:
+        results = [_optimise_hrp(returns, cov) for returns, cov in tasks.values()]
+    for key, w in zip(tasks.keys(), results):
+        _HRP_CACHE[key] = w
+        if len(_HRP_CACHE) > _HRP_CACHE_SIZE:
+            _HRP_CACHE.popitem(last = False)
+    return dict(zip(tasks.keys(), results))
+
+@timed("weights")
+@disk_cache(ignore = ("n_jobs", "batch_size", "stats"))
+def calculate_hrp_weights(prices_close, rolling = 50, rebalance_dates = None, n_jobs = 1, batch_size = 256, stats = None):
+    """
+    Calculate the Hierarchical Risk Parity (HRP) portfolio allocation weights, using the returns of the previous rolling days.
+    Instruments with a missing price in the window are excluded and keep an equal weight over instruments priced that day.
+
+    The covariance matrix is updated incrementally between windows, identical windows are optimised only once,
+    and the optimisations can be spread across a process pool.
+
+    Parameters:
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+        rolling (int): Number of days in the lookback window.
+        rebalance_dates (list-like): Dates on which weights are read, eg. the days the positions signal changes. None to optimise every day.
+            Weights are also re-optimised whenever the set of eligible instruments changes, and carried forward otherwise.
+        n_jobs (int): Number of worker processes for the optimisations. Default is 1, ie. no process pool.
+        batch_size (int): Number of windows prepared before the optimisations are run. Bounds memory.
+        stats (RollingStats): Rolling statistics of prices_close, to share them with other calls. Default is to compute them for this call only.
+
+    Returns:
+        pd.DataFrame: DataFrame of the weights, shape is (num of trading days, num of instruments).
+    """
+    prices = prices_close.to_numpy(dtype = float)
+    num_days, num_instruments = prices.shape
+    priced = ~np.isnan(prices)
+    # EQUAL WEIGHTS OVER INSTRUMENTS PRICED EACH DAY, UNTIL HRP WEIGHTS ARE AVAILABLE
+    with np.errstate(divide = "ignore"):
+        weights = np.repeat(1 / priced.sum(axis = 1, keepdims = True), num_instruments, axis = 1)
+    weights[~priced] = np.nan
+    if num_days <= rolling:
+        return pd.DataFrame(weights, index = prices_close.index, columns = prices_close.columns)
+
+    # INSTRUMENTS PRICED ON EVERY DAY OF THE WINDOW BEFORE EACH DAY, FROM DAY rolling ONWARDS
+    priced_count = np.vstack((np.zeros((1, num_instruments), dtype = int), np.cumsum(priced, axis = 0)))
+    eligible = (priced_count[rolling:] - priced_count[:(num_days - rolling + 1)])[:-1] == rolling
+    # DAYS TO OPTIMISE: REQUESTED DAYS AND DAYS WHERE THE ELIGIBLE INSTRUMENTS CHANGE
+    if rebalance_dates is None:
+        optimise = np.ones(num_days - rolling, dtype = bool)
+    else:
+        optimise = prices_close.index[rolling:].isin(rebalance_dates)
+        optimise[0] = True
+        optimise[1:] |= (eligible[1:] != eligible[:-1]).any(axis = 1)
+    days = np.flatnonzero(optimise) + rolling
+
+    # RETURNS OF DAY t ARE STORED IN ROW t, WINDOWS END THE DAY BEFORE
+    stats = RollingStats(prices_close) if stats is None else stats
+    returns = stats.returns.to_numpy()
+    window = rolling - 1
+    moments = stats.moments(window, days)
+
+    hrp_weights = np.full((len(days), num_instruments), np.nan)
+    pending, tasks = list(), dict()
+    # ONE PROCESS POOL FOR ALL BATCHES, STARTED BY THE FIRST ONE TO NEED IT
+    pool = None
+    try:
+        for i, (day, (s1, s2)) in enumerate(zip(days, moments)):
+            cols = np.flatnonzero(eligible[day - rolling])
+            if len(cols) > 1:
+                # if more than 1 price is available
+                returns_ = returns[(day - window):day, cols]
+                key = (tuple(prices_close.columns[cols]), hashlib.sha1(returns_.tobytes()).hexdigest())
+                if key in _HRP_CACHE:
+                    hrp_weights[i, cols] = _HRP_CACHE[key]
+                    _HRP_CACHE.move_to_end(key)
+                    count("hrp_cache_hits")
+                else:
+                    if key not in tasks:
+                        cov = (s2[np.ix_(cols, cols)] - np.outer(s1[cols], s1[cols]) / window) / (window - 1)
+                        tasks[key] = (
+                            pd.DataFrame(returns_, columns = prices_close.columns[cols]),
+                            pd.DataFrame(cov, index = prices_close.columns[cols], columns = prices_close.columns[cols])
+                        )
+                    pending.append((i, cols, key))
+            elif len(cols) == 1:
+                # if only 1 price available
+                hrp_weights[i, cols] = 1
+            if tasks and (len(tasks) >= batch_size or i == len(days) - 1):
+                if pool is None and n_jobs > 1 and len(tasks) > 1:
+                    pool = ProcessPoolExecutor(max_workers = n_jobs)
+                results = _run_optimisations(tasks, pool, n_jobs)
+                for j, cols_, key_ in pending:
+                    hrp_weights[j, cols_] = results[key_]
+                pending, tasks = list(), dict()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # CARRY THE LATEST OPTIMISED WEIGHTS FORWARD TO EACH DAY
+    latest = np.searchsorted(days, np.arange(rolling, num_days), side = "right") - 1
+    weights_ = hrp_weights[latest]
+    weights[rolling:] = np.where(eligible, weights_, weights[rolling:])
+    return pd.DataFrame(weights, index = prices_close.index, columns = prices_close.columns)
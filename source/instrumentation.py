@@ -0,0 +1,121 @@
+import json
+import time
+import uuid
+import functools
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# TRACE OF THE CURRENT RUN, NONE WHEN INSTRUMENTATION IS OFF. EVERY HOOK RETURNS EARLY ON NONE
+_TRACE = None
+_NO_STAGE = nullcontext()
+
+def count(name, n = 1):
+    """
+    Increment a counter of the current run, eg. rebalance days or cache hits. No-op when no run is traced.
+
+    Parameters:
+        name (str): Name of the counter.
+        n (int): Increment.
+    """
+    if _TRACE is not None:
+        _TRACE["counters"][name] = _TRACE["counters"].get(name, 0) + n
+
+@contextmanager
+def _timed_stage(name):
+    """
+    Accumulate the wall-clock time of a block into a stage of the current run. Nested blocks of the same stage are timed once.
+    """
+    trace = _TRACE
+    if name in trace["_active"]:
+        yield
+        return
+    trace["_active"].add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace["_active"].discard(name)
+        stage_ = trace["stages"].setdefault(name, {"seconds" : 0., "calls" : 0})
+        stage_["seconds"] += time.perf_counter() - start
+        stage_["calls"] += 1
+
+def stage(name):
+    """
+    Context manager timing a block as a stage of the current run, eg. "backtest". No-op when no run is traced.
+
+    Parameters:
+        name (str): Name of the stage.
+    """
+    return _NO_STAGE if _TRACE is None else _timed_stage(name)
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a stage of the current run. No-op when no run is traced.
+
+    Parameters:
+        name (str): Name of the stage, one of "read", "indicators", "positions", "weights", "backtest" or "metrics" for the pipeline.
+
+    Returns:
+        callable: Decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _TRACE is None:
+                return func(*args, **kwargs)
+            with _timed_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def trace_run(path = None, run_id = None, **tags):
+    """
+    Turn on instrumentation for a run: stage timers and counters are recorded into a trace until the block exits.
+
+    Parameters:
+        path (str): JSON lines file the trace is appended to on exit, to aggregate runs with load_traces(). None to only return it.
+        run_id (str): Identifier of the run. Default is a random identifier.
+        **tags: Parameters of the run stored with the trace, eg. buy_level = 25. Must be JSON serialisable.
+
+    Yields:
+        dict: Trace of the run, with keys "run_id", "tags", "started_at", "seconds", "stages" ({name : {"seconds", "calls"}}) and "counters".
+    """
+    global _TRACE
+    previous = _TRACE
+    trace = {
+        "run_id" : uuid.uuid4().hex if run_id is None else run_id,
+        "tags" : tags,
+        "started_at" : datetime.now(timezone.utc).isoformat(),
+        "seconds" : 0.,
+        "stages" : dict(),
+        "counters" : dict(),
+        "_active" : set()
+    }
+    _TRACE = trace
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace["seconds"] = time.perf_counter() - start
+        del trace["_active"]
+        _TRACE = previous
+        if path is not None:
+            with open(path, "a") as f:
+                f.write(json.dumps(trace) + "\n")
+
+def load_traces(path):
+    """
+    Load the traces of many runs as one table, for aggregation.
+
+    Parameters:
+        path (str): JSON lines file written by trace_run().
+
+    Returns:
+        pd.DataFrame: One row per run, with flattened columns eg. "tags.buy_level", "stages.backtest.seconds", "counters.rebalance_days".
+    """
+    with open(path) as f:
+        traces = [json.loads(line) for line in f if line.strip()]
+    return pd.json_normalize(traces).set_index("run_id")
@@ -0,0 +1,145 @@
+import pandas as pd
+import numpy as np
+
+from config import INTRADAY_STORE_PATH
+from source.price_store import stored_columns, stored_timestamps, read_columns, append_prices
+from source.instrumentation import timed
+
+def append_bars(bars, path = INTRADAY_STORE_PATH):
+    """
+    Append intraday bars (eg. minute bars) to an intraday store, creating it if needed. The store has the layout of the price store,
+    one memory-mapped binary file per field and ticker, with one row per bar instead of one per day. Only bars after the last stored bar are appended.
+    Timezone-aware timestamps are stored in their local (exchange) time.
+
+    Parameters:
+        bars (pd.DataFrame): Bars indexed by timestamp, with two-level columns (field, ticker) as returned by yf.download(), eg. ("Open", "MSFT").
+        path (str): Directory of the intraday store.
+
+    Returns:
+        int: Number of bars appended.
+    """
+    return append_prices(bars, path)
+
+def download_bars(tickers, interval = "1m", period = "7d", path = INTRADAY_STORE_PATH):
+    """
+    Download yahoo finance intraday bars into the intraday store. Yahoo finance only serves the most recent minute bars,
+    so run it regularly to build up a history.
+
+    Parameters:
+        tickers (list of str): Tickers to download.
+        interval (str): Bar size, eg. "1m".
+        period (str): Period to download, at most "7d" for minute bars.
+        path (str): Directory of the intraday store.
+
+    Returns:
+        int: Number of bars appended.
+    """
+    # YFINANCE IS ONLY IMPORTED FOR LIVE DOWNLOADS
+    import yfinance as yf
+    bars = yf.download(tickers = tickers, period = period, interval = interval, auto_adjust = True, multi_level_index = True)
+    return append_bars(bars, path) if len(bars) > 0 else 0
+
+def _aggregate(bars, labels):
+    """
+    Aggregate bars into coarser bars: first Open, highest High, lowest Low, summed Volume and last value of the other fields (eg. Close).
+    Missing values are skipped, and bars without any value are dropped.
+
+    Parameters:
+        bars (pd.DataFrame): Bars with two-level columns (field, ticker).
+        labels (pd.DatetimeIndex): Timestamp of the coarser bar of each row of bars.
+
+    Returns:
+        pd.DataFrame: Coarser bars, indexed by label, with the columns of bars.
+    """
+    fields = dict()
+    for field in bars.columns.get_level_values(0).unique():
+        grouped = bars.loc[:, field].groupby(labels)
+        match field:
+            case "Open":
+                fields[field] = grouped.first()
+            case "High":
+                fields[field] = grouped.max()
+            case "Low":
+                fields[field] = grouped.min()
+            case "Volume":
+                fields[field] = grouped.sum(min_count = 1)
+            case _:
+                fields[field] = grouped.last()
+    resampled = pd.concat(fields, axis = 1, names = bars.columns.names)
+    return resampled.loc[resampled.notna().any(axis = 1), :]
+
+def iter_bars(rule, fields = None, tickers = None, start = None, end = None, block_size = 1_000_000, path = INTRADAY_STORE_PATH):
+    """
+    Resample the bars of an intraday store block by block, reading only block_size stored bars at a time from the memory-mapped files.
+    A coarser bar spanning two blocks is completed before being yielded. Coarser bars with no stored bar (eg. overnight) are skipped.
+
+    Parameters:
+        rule (str): Fixed size of the coarser bars, eg. "5min", "1h" or "1D". None to keep the stored bars.
+        fields (list of str): Fields to load, eg. ["Close", "Open"]. Default is all stored fields.
+        tickers (list of str): Tickers to load. Default is all stored tickers.
+        start (datetime): First timestamp to load (inclusive). Default is the first stored bar.
+        end (datetime): Last timestamp to load (inclusive). Default is the last stored bar.
+        block_size (int): Number of stored bars read at once. Bounds peak memory.
+        path (str): Directory of the intraday store.
+
+    Yields:
+        pd.DataFrame: Consecutive blocks of coarser bars indexed by their start time, with two-level columns (field, ticker).
+    """
+    fields, tickers = stored_columns(path, fields, tickers, store = "intraday store")
+    # BINARY SEARCH OF THE MEMORY-MAPPED TIMESTAMPS, ONLY A FEW PAGES ARE READ
+    stamps = stored_timestamps(path)
+    first = 0 if start is None else int(np.searchsorted(stamps, pd.Timestamp(start).as_unit("ns").value))
+    last = len(stamps) if end is None else int(np.searchsorted(stamps, pd.Timestamp(end).as_unit("ns").value, side = "right"))
+    columns = pd.MultiIndex.from_product([fields, tickers], names = ["Price", "Ticker"])
+
+    carry = None
+    for block_start in range(first, last, block_size):
+        block_stop = min(block_start + block_size, last)
+        values = read_columns(path, fields, tickers, block_start, block_stop)
+        index = pd.DatetimeIndex(np.array(stamps[block_start:block_stop]).view("datetime64[ns]"), name = "Date")
+        bars = pd.DataFrame(values, index = index, columns = columns)
+        if rule is None:
+            yield bars
+            continue
+        bars = bars if carry is None else pd.concat((carry, bars))
+        labels = bars.index.floor(rule)
+        if block_stop < last:
+            # HOLD BACK THE LAST COARSER BAR, IT MAY CONTINUE IN THE NEXT BLOCK
+            cut = labels.searchsorted(labels[-1])
+            bars, carry, labels = bars.iloc[:cut], bars.iloc[cut:], labels[:cut]
+        if len(bars) > 0:
+            yield _aggregate(bars, labels.rename("Date"))
+
+@timed("read")
+def load_bars(rule, fields = None, tickers = None, start = None, end = None, block_size = 1_000_000, path = INTRADAY_STORE_PATH):
+    """
+    Load the bars of an intraday store resampled to a coarser bar size, see iter_bars().
+
+    Returns:
+        pd.DataFrame: Coarser bars indexed by their start time, with two-level columns (field, ticker) as returned by load_prices().
+    """
+    blocks = list(iter_bars(rule, fields, tickers, start, end, block_size, path))
+    if len(blocks) == 0:
+        return pd.DataFrame(columns = pd.MultiIndex.from_product([fields or [], tickers or []], names = ["Price", "Ticker"]), index = pd.DatetimeIndex([], name = "Date"))
+    return pd.concat(blocks)
+
+def read_intraday(rule, tickers = None, start = None, end = None, path = INTRADAY_STORE_PATH):
+    """
+    Read intraday prices at a given bar size, for the indicator, position and backtest functions, as read_data() does for daily prices.
+    The open price of a bar is its first traded price and the close price its last, so signals evaluated on a bar's close are acted on at the next bar's open.
+
+    Note that calculate_portfolio_metrics() annualises with BUSINESS_DAYS, so pass it the AUM of the last bar of each day,
+    eg. aum.groupby(aum.index.normalize()).last().
+
+    Parameters:
+        rule (str): Fixed size of the bars, eg. "5min", "1h" or "1D".
+        tickers (list of str): Tickers to read. Default is all stored tickers.
+        start (datetime): First timestamp to read (inclusive).
+        end (datetime): Last timestamp to read (inclusive).
+        path (str): Directory of the intraday store.
+
+    Returns:
+        tuple: Tuple of two dataframes (prices_close, prices_open) of the size (num of bars, len(tickers)).
+    """
+    bars = load_bars(rule, ["Close", "Open"], tickers, start, end, path = path)
+    return bars.loc[:, "Close"], bars.loc[:, "Open"]
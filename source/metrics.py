@@ -2,55 +2,88 @@ import pandas as pd
 import numpy as np
 
 from config import CAPITAL_0, RISK_FREE_RATE, BUSINESS_DAYS, COMMISSION_RATE, SLIPPAGE_RATE
+from source.instrumentation import timed
+from source.rolling import RollingStats
 
-def _calculate_trade_by_trade_metrics(portfolio, prices_open):
+def extract_trades(portfolio, prices_open):
     """
-    Calculate trade-by-trade profit. A trade is completed when a non-zero position completely closed.
+    Extract the round-trip trades of all instruments at once. A trade is completed when a non-zero position completely closed.
     Rebalancing does not constitute as a trade, but the profit/loss will be added to the trade results.
+    Positions still open at the end of testing are closed at the market open price of their last transaction.
 
     Parameters:
         portfolio (pd.DataFrame): DataFrame of the open positions (in number of shares), shape is (num of trading days, num of instruments).
         prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
 
     Returns:
-        dict of pd.Series: Dictionary with each key being a ticker, each item is a pd.Series of length = number of trades, and value equals to the profit/loss of each trade closed on the date specified in the index.
+        pd.DataFrame: Table of trades ordered by ticker and exit date, with columns
+            ticker (category), entry_date and exit_date (datetime), holding_period (int, in trading days),
+            cost, revenue, fees and profit (float, in $, cost and revenue including fees), closed (bool, False if closed at the end of testing).
     """
-    trade_metrics = dict()
-    for ticker in portfolio.columns:
-        # Change in position size ie trades
-        transactions = portfolio.loc[:, ticker].diff().replace({0 : np.nan}).dropna()
-        # Initialisation
-        profits, indices = list(), list()
-        cost, rev, pos = 0, 0, 0
-        # For each change in position sizing
-        for date, pos_change in zip(transactions.index, transactions):
-            if pos_change > 0: # if buy
-                cost += pos_change * prices_open.loc[date, ticker] * (1 + COMMISSION_RATE + SLIPPAGE_RATE)
-                pos += pos_change
-            else: # if sell
-                rev += abs(pos_change) * prices_open.loc[date, ticker] * (1 - COMMISSION_RATE - SLIPPAGE_RATE)
-                pos += pos_change
-            # Completed a full trade (ie sold off everything)
-            if pos == 0:
-                profit = rev - cost
-                profits.append(profit)
-                indices.append(date)
-                # RESET
-                cost, rev, pos = 0, 0, 0
-        # CLOSE ANY REMAINING POSITIONS AT THE END OF TESTING
-        if pos > 0:
-            rev += abs(pos) * prices_open.loc[date, ticker] * (1 - COMMISSION_RATE - SLIPPAGE_RATE)
-            pos = 0
-            profit = rev - cost
-            profits.append(profit)
-            indices.append(date)
-        # OUTPUT
-        trades = pd.Series(profits, indices)
-        trade_metrics[ticker] = trades
-    return trade_metrics
-
+    # CHANGE IN POSITION SIZE IE TRANSACTIONS, IN (TICKER, DATE) ORDER
+    positions = portfolio.to_numpy(dtype = float)
+    changes = (positions[1:] - positions[:-1]).T
+    is_transaction = (changes != 0) & ~np.isnan(changes)
+    tickers, days = np.nonzero(is_transaction)
+    return _trades_from_transactions(tickers, days + 1, changes[is_transaction], portfolio.index, portfolio.columns, prices_open)
+
+def _trades_from_transactions(tickers, days, changes, index, columns, prices_open):
+    """
+    Extract the round-trip trades from transactions, see extract_trades().
 
+    Parameters:
+        tickers, days (np.ndarray): Positions in columns and index of each transaction, in (ticker, date) order.
+        changes (np.ndarray): Change in position size (in number of shares) of each transaction.
+        index (pd.Index): Trading days.
+        columns (pd.Index): Instruments.
+        prices_open (pd.DataFrame): DataFrame of the market open prices.
 
+    Returns:
+        pd.DataFrame: Table of trades, see extract_trades().
+    """
+    # RUNNING POSITION OF EACH TICKER AFTER EACH TRANSACTION
+    running = pd.Series(changes).groupby(tickers).cumsum().to_numpy()
+    prices = prices_open.loc[index, columns].to_numpy(dtype = float)[days, tickers]
+
+    # SEGMENT TRANSACTIONS INTO TRADES: A NEW TRADE STARTS AFTER A POSITION IS CLOSED, OR ON A NEW TICKER
+    closes = running == 0
+    new_trade = np.ones(len(changes), dtype = bool)
+    new_trade[1:] = closes[:-1] | (tickers[1:] != tickers[:-1])
+    trade_ids = np.cumsum(new_trade) - 1
+    num_trades = trade_ids[-1] + 1 if len(trade_ids) > 0 else 0
+
+    buys = changes > 0
+    amounts = np.abs(changes) * prices
+    # ACCUMULATE IN TRANSACTION ORDER
+    cost, revenue, fees = np.zeros(num_trades), np.zeros(num_trades), np.zeros(num_trades)
+    np.add.at(cost, trade_ids[buys], changes[buys] * prices[buys] * (1 + COMMISSION_RATE + SLIPPAGE_RATE))
+    np.add.at(revenue, trade_ids[~buys], amounts[~buys] * (1 - COMMISSION_RATE - SLIPPAGE_RATE))
+    np.add.at(fees, trade_ids, amounts * (COMMISSION_RATE + SLIPPAGE_RATE))
+    # CLOSE ANY REMAINING POSITIONS AT THE END OF TESTING
+    last = np.ones(len(changes), dtype = bool)
+    last[:-1] = tickers[1:] != tickers[:-1]
+    remaining = last & (running > 0)
+    amounts = running[remaining] * prices[remaining]
+    np.add.at(revenue, trade_ids[remaining], amounts * (1 - COMMISSION_RATE - SLIPPAGE_RATE))
+    np.add.at(fees, trade_ids[remaining], amounts * (COMMISSION_RATE + SLIPPAGE_RATE))
+
+    # OUTPUT, ONLY TRADES CLOSED OR CLOSED AT THE END OF TESTING
+    ends = np.flatnonzero(closes | remaining)
+    entries = np.flatnonzero(new_trade)[trade_ids[ends]]
+    trade_ids = trade_ids[ends]
+    return pd.DataFrame({
+        "ticker" : pd.Categorical.from_codes(tickers[ends], categories = columns),
+        "entry_date" : index[days[entries]],
+        "exit_date" : index[days[ends]],
+        "holding_period" : (days[ends] - days[entries]).astype(np.int64),
+        "cost" : cost[trade_ids],
+        "revenue" : revenue[trade_ids],
+        "fees" : fees[trade_ids],
+        "profit" : revenue[trade_ids] - cost[trade_ids],
+        "closed" : closes[ends]
+    })
+
+@timed("metrics")
 def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
     """
     Calculate portfolio metrics.
@@ -61,6 +94,40 @@ def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
         portfolio (pd.DataFrame): DataFrame of the number of open positions (in number of shares) given each day, shape is (num of trading days, num of instruments).
         prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
 
+    Returns:
+        metrics (dict): Dictionary of main metrics.
+        metadata (dict): Additional data.
+    """
+    trades = extract_trades(portfolio, prices_open)
+    return _portfolio_metrics(aum, trade_count.iloc[:, 0].sum(), portfolio.columns, trades)
+
+@timed("metrics")
+def calculate_result_metrics(result, prices_open):
+    """
+    Calculate portfolio metrics of a BacktestResult returned by run_backtest_compact(), without rebuilding its daily tables.
+    Identical to calculate_portfolio_metrics() on the DataFrames of run_backtest().
+
+    Parameters:
+        result (BacktestResult): Outputs of the backtest.
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+
+    Returns:
+        metrics (dict): Dictionary of main metrics.
+        metadata (dict): Additional data.
+    """
+    trades = _trades_from_transactions(*result.transactions(), result.index, result.columns, prices_open)
+    return _portfolio_metrics(result.aum, result.num_trades, result.columns, trades)
+
+def _portfolio_metrics(aum, num_trades, columns, trades):
+    """
+    Calculate portfolio metrics from the daily AUM and the round-trip trades, see calculate_portfolio_metrics().
+
+    Parameters:
+        aum (pd.Series): Series of the total value of Asset Under Management daily.
+        num_trades (int): Total number of trades executed.
+        columns (pd.Index): Instruments.
+        trades (pd.DataFrame): Table of trades returned by extract_trades().
+
     Returns:
         metrics (dict): Dictionary of main metrics.
         metadata (dict): Additional data.
@@ -69,15 +136,15 @@ def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
     total_return = (aum.iloc[-1] - CAPITAL_0) / CAPITAL_0
 
     # METRIC: Annual Return - no RFR adjustments
-    daily_returns = aum.astype(float).pct_change().dropna()
+    stats = RollingStats(aum)
+    daily_returns = stats.returns.dropna()
     annualised_returns = (1 + daily_returns.mean()) ** BUSINESS_DAYS - 1
 
     # METRIC: Annual Volatility - no RFR adjustments
     annualised_volatility = daily_returns.std() * np.sqrt(BUSINESS_DAYS)
 
     # METRIC: Max Drawdown - no RFR adjustments
-    rolling_max = aum.cummax()
-    drawdowns = aum / rolling_max - 1
+    drawdowns = stats.drawdowns()
 
     # METRIC - Sharpe Ratio - RFR-adjusted
     excess_daily_returns = daily_returns - (RISK_FREE_RATE / 252)
@@ -87,20 +154,21 @@ def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
     sortino_ratio = np.sqrt(BUSINESS_DAYS) * np.mean(excess_daily_returns / excess_daily_returns.clip(None, 0).std())
 
     # METRICS - Win Rate & Expectancy
-    trade_metrics = _calculate_trade_by_trade_metrics(portfolio, prices_open)
-    expectancy_table = dict()
     # for each ticker
-    for key in trade_metrics.keys():
-        trades = trade_metrics.get(key)
-        win_rate_ = np.mean(trades > 0)
-        avg_win_ = trades[trades > 0].mean()
-        avg_lose_ = trades[trades < 0].mean()
-        expectancy_table[key] = [win_rate_, win_rate_ * avg_win_ - (1 - win_rate_) * abs(avg_lose_)]
+    codes, profits = trades.loc[:, "ticker"].cat.codes.to_numpy(), trades.loc[:, "profit"].to_numpy()
+    count = lambda mask : np.bincount(codes, weights = mask, minlength = len(columns))
+    total = lambda mask : np.bincount(codes, weights = np.where(mask, profits, 0), minlength = len(columns))
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        win_rate_ = count(profits > 0) / count(np.ones(len(profits)))
+        avg_win_ = total(profits > 0) / count(profits > 0)
+        avg_lose_ = total(profits < 0) / count(profits < 0)
+    expectancy_ = win_rate_ * avg_win_ - (1 - win_rate_) * np.abs(avg_lose_)
+    expectancy_table = {ticker : [win_rate_[i], expectancy_[i]] for i, ticker in enumerate(columns)}
     # full portfolio
-    trades = pd.concat([trade_metrics.get(key) for key in trade_metrics.keys()])
-    win_rate = np.mean(trades > 0)
-    avg_win = trades[trades > 0].mean()
-    avg_lose = trades[trades < 0].mean()
+    profits = trades.loc[:, "profit"]
+    win_rate = np.mean(profits > 0)
+    avg_win = profits[profits > 0].mean()
+    avg_lose = profits[profits < 0].mean()
 
     # OUTPUT
     metrics = {
@@ -110,8 +178,8 @@ def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
         "Maximum Drawdown" : abs(drawdowns.min()),
         "Sharpe Ratio" : sharpe_ratio,
         "Sortino Ratio" : sortino_ratio,
-        "Total Number of Trades" : trade_count.iloc[:, 0].sum(),
-        "Average Return per Trade" : total_return / trade_count.iloc[:, 0].sum(),
+        "Total Number of Trades" : num_trades,
+        "Average Return per Trade" : total_return / num_trades,
         "Win Rate" : win_rate,
         "Expectancy" : win_rate * avg_win - (1 - win_rate) * abs(avg_lose)
     }
@@ -119,7 +187,12 @@ def calculate_portfolio_metrics(aum, trade_count, portfolio, prices_open):
     metadata = {
         "drawdowns" : drawdowns,
         "expectancy_table" : expectancy_table,
-        "trade_metrics" : trade_metrics
+        "trades" : trades,
+        # DEPRECATED, TO BE REMOVED IN THE NEXT RELEASE: PROFIT OF EACH TRADE PER TICKER, INDEXED BY EXIT DATE. USE "trades" INSTEAD
+        "trade_metrics" : {
+            ticker : pd.Series(group.loc[:, "profit"].to_numpy(), pd.DatetimeIndex(group.loc[:, "exit_date"].to_numpy()))
+            for ticker, group in trades.groupby("ticker", observed = False, sort = False)
+        }
     }
 
     return metrics, metadata
\ No newline at end of file
@@ -0,0 +1,309 @@
+import os
+import json
+import shutil
+from urllib.parse import quote
+
+import pandas as pd
+import numpy as np
+
+# LAYOUT OF A PRICE STORE DIRECTORY:
+#   meta.json               - fields, tickers and number of stored days
+#   dates.i8                - int64 timestamps (ns) of the stored days, shared by all columns
+#   <field>/<ticker>.f8     - float64 values of one field of one ticker, aligned to dates.i8. Absent if never written, read as missing (NaN)
+_META_FILE = "meta.json"
+_DATES_FILE = "dates.i8"
+
+def _column_path(path, field, ticker):
+    """
+    Path of the column file of one field of one ticker.
+    """
+    return os.path.join(path, quote(field, safe = ""), quote(ticker, safe = "") + ".f8")
+
+def _read_meta(path):
+    """
+    Read the metadata of a price store.
+
+    Parameters:
+        path (str): Directory of the price store.
+
+    Returns:
+        dict: Metadata with keys "fields", "tickers" and "num_days". Empty store if the directory does not exist.
+    """
+    meta_path = os.path.join(path, _META_FILE)
+    if not os.path.isfile(meta_path):
+        return {"fields" : [], "tickers" : [], "num_days" : 0}
+    with open(meta_path) as f:
+        return json.load(f)
+
+def _write_meta(path, meta):
+    """
+    Write the metadata of a price store.
+    """
+    # WRITE-THEN-RENAME, SO AN INTERRUPTED APPEND LEAVES THE PREVIOUS STATE READABLE
+    tmp_path = os.path.join(path, _META_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(path, _META_FILE))
+
+def _read_column(file_path, start, stop, dtype = np.float64):
+    """
+    Memory-map rows [start, stop) of a column file, without loading the rest of the file.
+    """
+    if stop <= start:
+        return np.empty(0, dtype = dtype)
+    itemsize = np.dtype(dtype).itemsize
+    return np.memmap(file_path, dtype = dtype, mode = "r", offset = start * itemsize, shape = (stop - start, ))
+
+def _append_column(file_path, values, num_days):
+    """
+    Append values to a column file holding num_days rows. Rows beyond num_days, left by an interrupted append, are discarded.
+    """
+    with open(file_path, "ab") as f:
+        f.truncate(num_days * values.itemsize)
+        f.write(values.tobytes())
+
+def _normalise_index(prices):
+    """
+    Sort price data by date, with timezone-naive nanosecond timestamps as stored.
+    """
+    prices = prices.sort_index()
+    prices.index = pd.DatetimeIndex(prices.index).tz_localize(None).as_unit("ns")
+    return prices
+
+def stored_dates(path):
+    """
+    Read the dates held in a price store.
+
+    Parameters:
+        path (str): Directory of the price store.
+
+    Returns:
+        pd.DatetimeIndex: Stored dates, empty if nothing is stored.
+    """
+    return pd.DatetimeIndex(np.array(stored_timestamps(path)).view("datetime64[ns]"))
+
+def stored_timestamps(path):
+    """
+    Memory-map the dates held in a price store, without loading them, eg. to binary search a long intraday store.
+
+    Parameters:
+        path (str): Directory of the price store.
+
+    Returns:
+        np.ndarray: Stored dates as int64 timestamps (ns), empty if nothing is stored.
+    """
+    return _read_column(os.path.join(path, _DATES_FILE), 0, _read_meta(path)["num_days"], dtype = np.int64)
+
+def stored_tickers(path, field = None):
+    """
+    Read the tickers held in a price store.
+
+    Parameters:
+        path (str): Directory of the price store.
+        field (str): Only the tickers with values written for this field. Default is all stored tickers.
+
+    Returns:
+        list of str: Stored tickers, empty if nothing is stored.
+    """
+    tickers = _read_meta(path)["tickers"]
+    return tickers if field is None else [ticker for ticker in tickers if os.path.isfile(_column_path(path, field, ticker))]
+
+def last_stored_date(path, ticker, field = "Close"):
+    """
+    Read the last date with a value of a ticker in a price store, eg. to only download the days after it.
+
+    Parameters:
+        path (str): Directory of the price store.
+        ticker (str): Ticker.
+        field (str): Field whose values are looked up. Default is "Close".
+
+    Returns:
+        pd.Timestamp: Last date with a (non-NaN) value, None if the ticker has no value stored.
+    """
+    meta = _read_meta(path)
+    if ticker not in meta["tickers"] or field not in meta["fields"]:
+        return None
+    available = np.flatnonzero(~np.isnan(read_columns(path, [field], [ticker], 0, meta["num_days"])[:, 0]))
+    return stored_dates(path)[available[-1]] if len(available) > 0 else None
+
+def stored_columns(path, fields = None, tickers = None, store = "price store"):
+    """
+    Check that fields and tickers are held in a price store.
+
+    Parameters:
+        path (str): Directory of the price store.
+        fields (list of str): Requested fields. Default is all stored fields.
+        tickers (list of str): Requested tickers. Default is all stored tickers.
+        store (str): Name of the store in error messages.
+
+    Returns:
+        tuple: (fields, tickers) as lists. Raises KeyError if any of them is not stored.
+    """
+    meta = _read_meta(path)
+    fields = meta["fields"] if fields is None else list(fields)
+    tickers = meta["tickers"] if tickers is None else list(tickers)
+    for name, requested, stored in (("fields", fields, meta["fields"]), ("tickers", tickers, meta["tickers"])):
+        missing = [item for item in requested if item not in stored]
+        if len(missing) > 0:
+            raise KeyError(f"{name} not in {store}: {missing}")
+    return fields, tickers
+
+def read_columns(path, fields, tickers, start, stop):
+    """
+    Read rows [start, stop) of the requested columns of a price store, from memory-mapped files. Columns never written are read as missing (NaN).
+
+    Parameters:
+        path (str): Directory of the price store.
+        fields (list of str): Stored fields, see stored_columns().
+        tickers (list of str): Stored tickers.
+        start, stop (int): Positions of the first and past-the-last rows, as in stored_timestamps().
+
+    Returns:
+        np.ndarray: Values, one column per (field, ticker) in the order of pd.MultiIndex.from_product([fields, tickers]),
+            shape is (stop - start, len(fields) * len(tickers)).
+    """
+    values = np.empty((max(stop - start, 0), len(fields) * len(tickers)))
+    for i, field in enumerate(fields):
+        for j, ticker in enumerate(tickers):
+            file_path = _column_path(path, field, ticker)
+            values[:, i * len(tickers) + j] = _read_column(file_path, start, stop) if os.path.isfile(file_path) else np.nan
+    return values
+
+def _recover(path):
+    """
+    Complete or roll back a rewrite of _insert_dates() interrupted by a crash. Called before writing, as a store has a single writer at a time.
+    """
+    tmp_path, old_path = path.rstrip(os.sep) + ".tmp", path.rstrip(os.sep) + ".old"
+    if not os.path.isdir(path) and os.path.isdir(old_path):
+        # CRASHED BETWEEN THE TWO RENAMES: THE REWRITTEN STORE IS COMPLETE, OTHERWISE KEEP THE ORIGINAL ONE
+        os.rename(tmp_path if os.path.isdir(tmp_path) else old_path, path)
+    # PARTIAL REWRITE, OR ORIGINAL STORE LEFT AFTER THE SWAP
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    shutil.rmtree(old_path, ignore_errors = True)
+
+def append_prices(prices, path):
+    """
+    Append price data to a price store, creating it if needed. Only days after the last stored date are appended,
+    except for columns new to the store, which are also filled in on the stored days. Only the (field, ticker) columns of prices
+    are written, eg. a field of a single ticker does not create a column of missing values for every other ticker.
+
+    Parameters:
+        prices (pd.DataFrame): Price data indexed by date, with two-level columns (field, ticker) as returned by yf.download().
+        path (str): Directory of the price store.
+
+    Returns:
+        int: Number of days appended.
+    """
+    _recover(path)
+    os.makedirs(path, exist_ok = True)
+    meta = _read_meta(path)
+    num_days = meta["num_days"]
+    dates = stored_dates(path)
+    prices = _normalise_index(prices)
+    new_dates = prices.index[prices.index > dates[-1]] if num_days > 0 else prices.index
+
+    fields = list(dict.fromkeys(meta["fields"] + prices.columns.get_level_values(0).tolist()))
+    tickers = list(dict.fromkeys(meta["tickers"] + prices.columns.get_level_values(1).tolist()))
+    for field in fields:
+        os.makedirs(os.path.join(path, quote(field, safe = "")), exist_ok = True)
+        for ticker in tickers:
+            file_path = _column_path(path, field, ticker)
+            existing = field in meta["fields"] and ticker in meta["tickers"] and os.path.isfile(file_path)
+            if existing and len(new_dates) == 0:
+                # NOTHING TO ADD TO AN EXISTING COLUMN
+                continue
+            if not existing and (field, ticker) not in prices.columns:
+                # NEVER WRITTEN, LEFT OUT RATHER THAN FILLED WITH MISSING VALUES
+                continue
+            if (field, ticker) in prices.columns:
+                column = prices.loc[:, (field, ticker)]
+            else:
+                column = pd.Series(np.nan, index = prices.index)
+            if existing:
+                # EXISTING COLUMN, ONLY ADD THE NEW DAYS
+                values, stored = column.reindex(new_dates), num_days
+            else:
+                # NEW COLUMN, ALSO FILL IN THE STORED DAYS
+                values, stored = column.reindex(dates.append(new_dates)), 0
+            _append_column(file_path, values.to_numpy(dtype = np.float64), stored)
+    _append_column(os.path.join(path, _DATES_FILE), new_dates.asi8, num_days)
+    _write_meta(path, {"fields" : fields, "tickers" : tickers, "num_days" : num_days + len(new_dates)})
+    return len(new_dates)
+
+def _insert_dates(path, new_dates):
+    """
+    Rewrite a price store with more days, missing (NaN) for every stored ticker. The store is rebuilt one ticker at a time
+    next to the original, then swapped in. A crash is recovered from by the next write, see _recover().
+    """
+    _recover(path)
+    meta = _read_meta(path)
+    dates = stored_dates(path).append(pd.DatetimeIndex(new_dates)).unique().sort_values()
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    for ticker in meta["tickers"]:
+        append_prices(load_prices(path, tickers = [ticker]).reindex(dates), tmp_path)
+    old_path = path.rstrip(os.sep) + ".old"
+    os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path)
+
+def update_prices(prices, path):
+    """
+    Write price data to a price store, creating it if needed. Unlike append_prices(), the values of tickers already stored
+    are also written on days already stored, so that tickers can be written one at a time as they are downloaded.
+    Missing (NaN) values do not overwrite stored values. Days missing from the store before its last date, eg. the history of a ticker
+    listed before every stored ticker, are inserted, which rewrites the whole store.
+
+    Parameters:
+        prices (pd.DataFrame): Price data indexed by date, with two-level columns (field, ticker) as returned by yf.download().
+        path (str): Directory of the price store.
+
+    Returns:
+        int: Number of days appended.
+    """
+    _recover(path)
+    prices = _normalise_index(prices)
+    dates = stored_dates(path)
+    earlier = prices.index[(prices.index < dates[-1]) & ~prices.index.isin(dates)] if len(dates) > 0 else prices.index[:0]
+    if len(earlier) > 0:
+        _insert_dates(path, earlier)
+    meta = _read_meta(path)
+    dates = stored_dates(path)
+    # COLUMNS NEW TO THE STORE ARE FILLED IN ON THE STORED DAYS BY append_prices()
+    stored_columns = [
+        (field, ticker) for field, ticker in prices.columns
+        if field in meta["fields"] and ticker in meta["tickers"] and os.path.isfile(_column_path(path, field, ticker))
+    ]
+    num_appended = append_prices(prices, path)
+    prices = prices.loc[prices.index.isin(dates), :]
+    rows = dates.get_indexer(prices.index)
+    for field, ticker in stored_columns:
+        values = prices.loc[:, (field, ticker)].to_numpy(dtype = np.float64)
+        available = ~np.isnan(values)
+        if available.any():
+            column = np.memmap(_column_path(path, field, ticker), dtype = np.float64, mode = "r+", shape = (meta["num_days"], ))
+            column[rows[available]] = values[available]
+            column.flush()
+            del column
+    return num_appended
+
+def load_prices(path, fields = None, tickers = None, start = None, end = None):
+    """
+    Load price data from a price store. Only the requested fields, tickers and date range are read from disk.
+
+    Parameters:
+        path (str): Directory of the price store.
+        fields (list of str): Fields to load, eg. ["Close", "Open"]. Default is all stored fields.
+        tickers (list of str): Tickers to load. Default is all stored tickers.
+        start (datetime): First date to load (inclusive). Default is the first stored date.
+        end (datetime): Last date to load (inclusive). Default is the last stored date.
+
+    Returns:
+        pd.DataFrame: Price data indexed by date, with two-level columns (field, ticker) as returned by yf.download().
+    """
+    fields, tickers = stored_columns(path, fields, tickers)
+    dates = stored_dates(path)
+    first = 0 if start is None else dates.searchsorted(pd.Timestamp(start))
+    last = len(dates) if end is None else dates.searchsorted(pd.Timestamp(end), side = "right")
+    values = read_columns(path, fields, tickers, first, last)
+    columns = pd.MultiIndex.from_product([fields, tickers], names = ["Price", "Ticker"])
+    return pd.DataFrame(values, index = dates[first:last].rename("Date"), columns = columns)
@@ -1,35 +1,66 @@
 import os
-import yfinance as yf
-import numpy as np
 import pandas as pd
 from dateutil.relativedelta import relativedelta
 
-from config import LIST_OF_STOCKS, BACKTEST_START, BACKTEST_END, RSI_PERIOD
+from config import LIST_OF_STOCKS, BACKTEST_START, BACKTEST_END, RSI_PERIOD, PRICE_STORE_PATH
+from source.price_store import append_prices, load_prices, stored_dates, stored_tickers
+from source.instrumentation import timed
 
-def read_data(use_backup = False):
+def _migrate_backup():
     """
-    Read yahoo finance price data.
+    Migrate the legacy CSV backup (data/data_backup.csv), if any, into the local price store when the store is empty.
+    """
+    legacy_path = os.path.join("data", "data_backup.csv")
+    if len(stored_dates(PRICE_STORE_PATH)) == 0 and os.path.isfile(legacy_path):
+        append_prices(pd.read_csv(legacy_path, parse_dates = [0], index_col = 0, header = [0, 1]), PRICE_STORE_PATH)
+
+def _update_store(tickers):
+    """
+    Download yahoo finance price data into the local price store. Only days after the last stored date are downloaded,
+    except for tickers new to the store, whose full history is downloaded.
+
+    Parameters:
+        tickers (list of str): Tickers to update.
+    """
+    # YFINANCE IS ONLY IMPORTED FOR LIVE DOWNLOADS, READING THE STORE DOES NOT NEED IT
+    import yfinance as yf
+    dates = stored_dates(PRICE_STORE_PATH)
+    # NEW DAYS FOR TICKERS ALREADY STORED
+    stored = [ticker for ticker in tickers if ticker in stored_tickers(PRICE_STORE_PATH)]
+    if len(stored) > 0:
+        prices = yf.download(tickers = stored, start = dates[-1] + relativedelta(days = 1), interval = '1d', auto_adjust = True, multi_level_index = True)
+        if len(prices) > 0:
+            append_prices(prices, PRICE_STORE_PATH)
+    # FULL HISTORY FOR TICKERS NEW TO THE STORE
+    new_tickers = [ticker for ticker in tickers if ticker not in stored_tickers(PRICE_STORE_PATH)]
+    if len(new_tickers) > 0:
+        prices = yf.download(tickers = new_tickers, period = 'max', interval = '1d', auto_adjust = True, multi_level_index = True)
+        append_prices(prices, PRICE_STORE_PATH)
+
+@timed("read")
+def read_data(use_backup = False, tickers = LIST_OF_STOCKS):
+    """
+    Read yahoo finance price data, through the local price store.
 
     Parameters:
-        use_backup (bool): Set to True to use backup data saved as csv. Use for connection issues etc.
+        use_backup (bool): Set to True to only read the local price store, without downloading. Use for connection issues etc.
+        tickers (list of str): Tickers to read. Default is LIST_OF_STOCKS. See source/universe.py for universes of thousands of tickers.
 
     Returns:
         tuple: Tuple of two dataframes (prices_close, prices_open) of the size (n, len(tickers)).
     """
     # Read data
-    backup_path = ".\\data\\data_backup.csv"
+    _migrate_backup()
     if not use_backup:
-        prices = yf.download(tickers = LIST_OF_STOCKS, period = 'max', interval = '1d', auto_adjust = True, multi_level_index = False)
-        if not os.path.isfile(backup_path):
-            prices.to_csv(backup_path)
-    else:
-        prices = pd.read_csv(backup_path, parse_dates = [0], index_col = 0, header = [0, 1])
+        _update_store(tickers)
+    dates = stored_dates(PRICE_STORE_PATH)
     # Validation
-    assert prices.index.min() <= BACKTEST_START - relativedelta(days = RSI_PERIOD)
-    assert prices.index.max() >= BACKTEST_END
+    assert len(dates) > 0, f"No price data stored in {PRICE_STORE_PATH}"
+    assert dates.min() <= BACKTEST_START - relativedelta(days = RSI_PERIOD)
+    assert dates.max() >= BACKTEST_END
     # Filter for required data
-    prices = prices[np.logical_and(prices.index >= BACKTEST_START - relativedelta(days = RSI_PERIOD), prices.index <= BACKTEST_END)]
+    prices = load_prices(PRICE_STORE_PATH, fields = ["Close", "Open"], tickers = tickers, start = BACKTEST_START - relativedelta(days = RSI_PERIOD), end = BACKTEST_END)
     # Split into two tables
     prices_close = prices.loc[:, "Close"]
     prices_open = prices.loc[:, "Open"]
-    return prices_close, prices_open
\ No newline at end of file
+    return prices_close, prices_open
@@ -0,0 +1,112 @@
+import numpy as np
+
+class RollingStats:
+    """
+    Rolling statistics of the daily returns of a price panel (or AUM series). Returns are computed once, and each statistic
+    is computed once per window. To share them, create one and pass it as the stats argument of calculate_voladj_weights()
+    and calculate_hrp_weights(); they are released with the last reference to it.
+
+    Parameters:
+        prices (pd.DataFrame or pd.Series): Prices, each instrument as a column. Copied, so later changes to prices are not reflected.
+    """
+    def __init__(self, prices):
+        self.prices = prices.astype(float)
+        self._returns = None
+        self._filled_returns = None
+        self._rolling = dict()
+
+    @property
+    def returns(self):
+        """
+        pd.DataFrame: Daily returns, from the last available price. NaN on the first day and before the first price.
+        """
+        if self._returns is None:
+            self._returns = self.prices.ffill().pct_change(fill_method = None)
+        return self._returns
+
+    def _rolling_stat(self, stat, window, lag):
+        key = (stat, window, lag)
+        if key not in self._rolling:
+            rolling = self.returns.shift(lag).rolling(window)
+            self._rolling[key] = getattr(rolling, stat)()
+        return self._rolling[key]
+
+    def mean(self, window, lag = 1):
+        """
+        Rolling mean of the daily returns.
+
+        Parameters:
+            window (int): Number of returns in each window.
+            lag (int): Number of days the returns are lagged by. Default is 1, ie. the window ends the day before.
+
+        Returns:
+            pd.DataFrame: Rolling means, NaN until window returns are available.
+        """
+        return self._rolling_stat("mean", window, lag)
+
+    def std(self, window, lag = 1):
+        """
+        Rolling standard deviation of the daily returns, see mean().
+        """
+        return self._rolling_stat("std", window, lag)
+
+    def moments(self, window, ends):
+        """
+        Yield the rolling sum and sum of outer products of the daily returns, updated incrementally between consecutive windows.
+        Missing returns count as 0.
+
+        Parameters:
+            window (int): Number of returns in each window.
+            ends (iterable of int): Increasing (exclusive) end rows of the windows.
+
+        Yields:
+            tuple: (sum of returns, sum of outer products of returns) over rows [end - window, end) of the returns.
+        """
+        if self._filled_returns is None:
+            self._filled_returns = np.nan_to_num(self.returns.to_numpy(), nan = 0.0, posinf = 0.0, neginf = 0.0)
+        returns = self._filled_returns
+        start, end, updates = 0, 0, window
+        for new_end in ends:
+            new_start = new_end - window
+            if new_start >= end or updates >= window:
+                # NO OVERLAP WITH THE PREVIOUS WINDOW, OR RESYNC TO BOUND ROUNDING DRIFT
+                block = returns[new_start:new_end]
+                s1, s2, updates = block.sum(axis = 0), block.T @ block, 0
+            else:
+                added, dropped = returns[end:new_end], returns[start:new_start]
+                s1 = s1 + added.sum(axis = 0) - dropped.sum(axis = 0)
+                s2 = s2 + added.T @ added - dropped.T @ dropped
+                updates += len(added)
+            start, end = new_start, new_end
+            yield s1, s2
+
+    def covariances(self, window, ends, correlation = False):
+        """
+        Yield the rolling covariance (or correlation) matrices of the daily returns, see moments().
+
+        Parameters:
+            window (int): Number of returns in each window.
+            ends (iterable of int): Increasing (exclusive) end rows of the windows.
+            correlation (bool): Set to True to yield correlation matrices instead.
+
+        Yields:
+            np.ndarray: Covariance (or correlation) matrix over rows [end - window, end) of the returns, shape is (num of instruments, num of instruments).
+        """
+        for s1, s2 in self.moments(window, ends):
+            cov = (s2 - np.outer(s1, s1) / window) / (window - 1)
+            if correlation:
+                with np.errstate(invalid = "ignore", divide = "ignore"):
+                    std = np.sqrt(np.diag(cov))
+                    cov = cov / np.outer(std, std)
+            yield cov
+
+    def drawdowns(self):
+        """
+        Drawdowns from the running maximum of the prices.
+
+        Returns:
+            pd.DataFrame or pd.Series: Drawdowns, 0 at a new maximum.
+        """
+        if "drawdowns" not in self._rolling:
+            self._rolling["drawdowns"] = self.prices / self.prices.cummax() - 1
+        return self._rolling["drawdowns"]
@@ -0,0 +1,28 @@
+import numpy as np
+
+def latch_positions(entries, exits, axis = 0):
+    """
+    Step a long-only position state machine through time for all instruments at once.
+    A position is opened on an entry, closed on an exit, and otherwise carried over from the previous step.
+    Entries take precedence over exits on the same step.
+
+    Parameters:
+        entries (np.ndarray): Boolean array, True where a long position is entered.
+        exits (np.ndarray): Boolean array of the same shape, True where an existing long position is exited.
+        axis (int): Time axis of the arrays. Default is 0.
+
+    Returns:
+        np.ndarray: Array of the same shape, 1 indicating an open long position, 0 indicating no position.
+    """
+    # EVENTS: 1 ENTER, 0 EXIT, -1 NO CHANGE TO POSITION
+    events = entries.astype(np.int8) - ~(entries | exits)
+    shape = [1] * events.ndim
+    shape[axis] = events.shape[axis]
+    steps = np.arange(events.shape[axis], dtype = np.int32 if events.shape[axis] < 2 ** 31 else np.int64).reshape(shape)
+    # STEP OF THE LATEST EVENT SO FAR, -1 IF NONE YET
+    last_event = np.where(events >= 0, steps, -1)
+    np.maximum.accumulate(last_event, axis = axis, out = last_event)
+    positions = np.take_along_axis(events, np.maximum(last_event, 0), axis = axis)
+    # NO POSITION BEFORE THE FIRST EVENT
+    positions[last_event < 0] = 0
+    return positions
@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy as np
+
+def _ewm_alpha(span = None, alpha = None):
+    """
+    Smoothing factor of an exponential moving average, derived the same way as pd.Series.ewm().
+    """
+    com = (span - 1) / 2 if span is not None else (1 - alpha) / alpha
+    return 1. / (1. + com)
+
+def _ewm_update(state, values, alpha, min_periods, ignore_na = False):
+    """
+    Update exponential moving averages (adjust = False) with one new value per instrument, the same way as pd.Series.ewm().mean().
+    Missing values decay the weight of the previous average without updating it, unless ignore_na is set.
+
+    Parameters:
+        state (dict): Dictionary with arrays "weighted", "old_wt" and "nobs", updated in place.
+        values (np.ndarray): New values, NaN where missing, shape is (num of instruments, ).
+        alpha (float): Smoothing factor.
+        min_periods (int): Minimum number of observations before a value is returned.
+        ignore_na (bool): Set to True to skip missing values entirely, as if they were dropped.
+
+    Returns:
+        np.ndarray: Updated moving averages, NaN before min_periods observations.
+    """
+    weighted, old_wt = state["weighted"], state["old_wt"]
+    observed = ~np.isnan(values)
+    state["nobs"] += observed
+    started = ~np.isnan(weighted)
+    old_wt[(started & observed) if ignore_na else started] *= 1. - alpha
+    # avoid numerical errors on constant series
+    update = started & observed & (weighted != values)
+    weighted[update] = (old_wt[update] * weighted[update] + alpha * values[update]) / (old_wt[update] + alpha)
+    old_wt[started & observed] = 1.
+    first = ~started & observed
+    weighted[first] = values[first]
+    return np.where(state["nobs"] >= min_periods, weighted, np.nan)
+
+def _new_ewm_state(num_instruments):
+    """
+    Initial state of exponential moving averages for _ewm_update().
+    """
+    return {"weighted" : np.full(num_instruments, np.nan), "old_wt" : np.ones(num_instruments), "nobs" : np.zeros(num_instruments, dtype = int)}
+
+class StreamingRSI:
+    """
+    Relative Strength Index (RSI) updated one bar at a time for all instruments, matching calculate_rsi().
+    Each update takes constant time regardless of the length of the history. Missing prices are skipped.
+
+    Parameters:
+        tickers (list of str): Instruments, in the order of the values passed to update().
+        smoothing (str): One of ("sma", "ema"). Smoothing moving average method.
+        period (int): Lookback period for RSI calculation. Default is 14.
+    """
+    def __init__(self, tickers, smoothing = "sma", period = 14):
+        if smoothing not in ("sma", "ema"):
+            raise NotImplementedError(f"{smoothing} is not a valid smoothing parameter.")
+        self.tickers = pd.Index(tickers)
+        self.smoothing = smoothing
+        self.period = period
+        num_instruments = len(self.tickers)
+        self._state = {
+            "last_price" : np.full(num_instruments, np.nan),
+            "count" : np.zeros(num_instruments, dtype = int),
+            # LAST period GAINS AND LOSSES (SMA), OR THEIR MOVING AVERAGES (EMA)
+            "gains" : np.zeros((period, num_instruments)),
+            "losses" : np.zeros((period, num_instruments)),
+            "ewm_gains" : _new_ewm_state(num_instruments),
+            "ewm_losses" : _new_ewm_state(num_instruments)
+        }
+
+    def update(self, prices):
+        """
+        Add a new bar.
+
+        Parameters:
+            prices (pd.Series): Closing prices of the bar indexed by ticker, NaN where missing.
+
+        Returns:
+            pd.Series: RSI values of the bar, NaN where the price is missing or fewer than period prices were seen.
+        """
+        prices = pd.Series(prices).reindex(self.tickers).to_numpy(dtype = float)
+        state = self._state
+        observed = ~np.isnan(prices)
+        # THE FIRST PRICE OF EACH INSTRUMENT HAS NO CHANGE, COUNTED AS NO GAIN AND NO LOSS
+        delta = np.where(np.isnan(state["last_price"]), 0., prices - state["last_price"])
+        gains = np.where(delta > 0, delta, 0.)
+        losses = -np.where(delta < 0, delta, 0.)
+        cols = np.flatnonzero(observed)
+        state["last_price"][cols] = prices[cols]
+        match self.smoothing:
+            case "sma":
+                rows = state["count"][cols] % self.period
+                state["gains"][rows, cols] = gains[cols]
+                state["losses"][rows, cols] = losses[cols]
+                state["count"][cols] += 1
+                avg_gains = state["gains"].sum(axis = 0) / self.period
+                avg_losses = state["losses"].sum(axis = 0) / self.period
+                # Avoid division by zero
+                avg_losses[avg_losses == 0] = 1e-10
+                rsi = 100 - (100 / (1 + avg_gains / avg_losses))
+            case "ema":
+                alpha = _ewm_alpha(alpha = 1 / self.period)
+                state["count"][cols] += 1
+                avg_gains = _ewm_update(state["ewm_gains"], np.where(observed, gains, np.nan), alpha, self.period, ignore_na = True)
+                avg_losses = _ewm_update(state["ewm_losses"], np.where(observed, losses, np.nan), alpha, self.period, ignore_na = True)
+                with np.errstate(divide = "ignore", invalid = "ignore"):
+                    rsi = np.where(avg_losses == 0, 100, 100 - (100 / (1 + avg_gains / avg_losses)))
+        rsi[~observed | (state["count"] < self.period)] = np.nan
+        return pd.Series(rsi, index = self.tickers)
+
+    def snapshot(self):
+        """
+        Copy the state of the indicator, eg. to persist it between sessions.
+
+        Returns:
+            dict: State of the indicator.
+        """
+        return _copy_state(self._state)
+
+    def restore(self, state):
+        """
+        Restore a state returned by snapshot().
+
+        Parameters:
+            state (dict): State of the indicator.
+        """
+        self._state = _copy_state(state)
+
+class StreamingMACDSignal:
+    """
+    MACD-based entry signal (enter at crossover) updated one bar at a time for all instruments, matching calculate_macd_signal().
+    Each update takes constant time regardless of the length of the history.
+
+    Parameters:
+        tickers (list of str): Instruments, in the order of the values passed to update().
+        window_fast (int): Span of the fast exponential moving average. Default is 12.
+        window_slow (int): Span of the slow exponential moving average. Default is 26.
+        window_sign (int): Span of the signal line. Default is 9.
+    """
+    def __init__(self, tickers, window_fast = 12, window_slow = 26, window_sign = 9):
+        self.tickers = pd.Index(tickers)
+        self.window_fast, self.window_slow, self.window_sign = window_fast, window_slow, window_sign
+        num_instruments = len(self.tickers)
+        self._state = {
+            "ewm_fast" : _new_ewm_state(num_instruments),
+            "ewm_slow" : _new_ewm_state(num_instruments),
+            "ewm_sign" : _new_ewm_state(num_instruments),
+            # 1 IF THE LAST MACD DIFFERENCE WAS NON-NEGATIVE, 0 IF NEGATIVE, NAN IF NONE YET
+            "last_side" : np.full(num_instruments, np.nan)
+        }
+
+    def update(self, prices):
+        """
+        Add a new bar.
+
+        Parameters:
+            prices (pd.Series): Closing prices of the bar indexed by ticker, NaN where missing.
+
+        Returns:
+            pd.Series: 1 where the MACD difference crosses over zero, -1 where it crosses under, 0 otherwise.
+                NaN until two MACD difference values are available.
+        """
+        prices = pd.Series(prices).reindex(self.tickers).to_numpy(dtype = float)
+        state = self._state
+        fast = _ewm_update(state["ewm_fast"], prices, _ewm_alpha(span = self.window_fast), self.window_fast)
+        slow = _ewm_update(state["ewm_slow"], prices, _ewm_alpha(span = self.window_slow), self.window_slow)
+        macd = fast - slow
+        macd_diff = macd - _ewm_update(state["ewm_sign"], macd, _ewm_alpha(span = self.window_sign), self.window_sign)
+        side = np.where(np.isnan(macd_diff), np.nan, (macd_diff >= 0).astype(float))
+        signal = side - state["last_side"]
+        state["last_side"] = np.where(np.isnan(side), state["last_side"], side)
+        return pd.Series(signal, index = self.tickers)
+
+    def snapshot(self):
+        """
+        Copy the state of the indicator, eg. to persist it between sessions.
+
+        Returns:
+            dict: State of the indicator.
+        """
+        return _copy_state(self._state)
+
+    def restore(self, state):
+        """
+        Restore a state returned by snapshot().
+
+        Parameters:
+            state (dict): State of the indicator.
+        """
+        self._state = _copy_state(state)
+
+def _copy_state(state):
+    """
+    Deep copy a (nested) dictionary of arrays.
+    """
+    return {key : _copy_state(value) if isinstance(value, dict) else value.copy() for key, value in state.items()}
@@ -0,0 +1,126 @@
+import itertools
+
+import pandas as pd
+import numpy as np
+
+from source.generate_positions_rsi import _generate_position_signal_rsi
+from source.generate_positions_macd import _generate_position_signal_macd
+from source.instrumentation import timed
+
+def _summarise_positions(positions):
+    """
+    Summarise batched positions for each parameter combination.
+
+    Parameters:
+        positions (np.ndarray): Positions of shape (num of combinations, num of trading days, num of instruments).
+
+    Returns:
+        dict of np.ndarray: Summary statistics, each of shape (num of combinations, ).
+    """
+    days_held = np.count_nonzero(positions, axis = (1, 2))
+    # A TRADE IS ENTERED WHEN THE POSITION GOES FROM 0 TO 1
+    entries = np.count_nonzero(positions[:, :1], axis = (1, 2)) + np.count_nonzero(positions[:, 1:] > positions[:, :-1], axis = (1, 2))
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        average_holding_period = np.where(entries > 0, days_held / entries, np.nan)
+    return {
+        "Number of Entries" : entries,
+        "Exposure" : days_held / (positions.shape[1] * positions.shape[2]),
+        "Average Holding Period" : average_holding_period
+    }
+
+def _run_sweep(grid, kernel, index, columns, output, chunk_size):
+    """
+    Evaluate a position kernel over a parameter grid in chunks of combinations.
+
+    Parameters:
+        grid (pd.DataFrame): Parameter combinations, one per row.
+        kernel (callable): Function mapping a slice of the grid to positions of shape (num of combinations in slice, num of trading days, num of instruments).
+        index (pd.Index): Trading days.
+        columns (pd.Index): Instruments.
+        output (str): One of ["positions", "summary"].
+        chunk_size (int): Number of combinations evaluated at once. Bounds peak memory.
+
+    Returns:
+        pd.DataFrame: Tidy table of positions or summary statistics for each combination.
+    """
+    if output not in ("positions", "summary"):
+        raise ValueError(f"Invalid output: {output}")
+    results = list()
+    for start in range(0, len(grid), chunk_size):
+        grid_ = grid.iloc[start:(start + chunk_size)]
+        positions = kernel(grid_)
+        if output == "positions":
+            levels = [np.repeat(grid_.loc[:, col].to_numpy(), len(index)) for col in grid_.columns]
+            levels.append(np.tile(index, len(grid_)))
+            results.append(pd.DataFrame(
+                positions.reshape(-1, len(columns)),
+                index = pd.MultiIndex.from_arrays(levels, names = list(grid_.columns) + [index.name or "Date"]),
+                columns = columns
+            ))
+        else:
+            results.append(pd.concat((grid_, pd.DataFrame(_summarise_positions(positions), index = grid_.index)), axis = 1))
+    return pd.concat(results)
+
+@timed("positions")
+def sweep_positions_rsi(rsi_close, buy_levels, sell_levels, exit_rsis = (None, ), output = "positions", chunk_size = 256):
+    """
+    Generate positions for every combination of RSI levels in one pass, in a (num of combinations, num of trading days, num of instruments) layout.
+    Positions of each combination equal generate_positions_rsi(rsi_close, buy_level, sell_level, exit_rsi).astype(float).fillna(0).
+
+    Parameters:
+        rsi_close (pd.DataFrame): All RSI time series values.
+        buy_levels (list of int): RSI levels to buy into a position.
+        sell_levels (list of int): RSI levels to sell a position.
+        exit_rsis (list of float): RSI points from buy_level to exit existing position. None disables the exit.
+        output (str): One of ["positions", "summary"]. "positions" returns the positions indexed by (buy_level, sell_level, exit_rsi, date),
+            "summary" returns one row of summary statistics per combination.
+        chunk_size (int): Number of combinations evaluated at once. Bounds peak memory.
+
+    Returns:
+        pd.DataFrame: Tidy table of positions or summary statistics for each combination.
+    """
+    grid = pd.DataFrame(list(itertools.product(buy_levels, sell_levels, exit_rsis)), columns = ["buy_level", "sell_level", "exit_rsi"])
+    # KEEP DAYS WITH AT LEAST ONE RSI VALUE, AS IN generate_positions_rsi
+    rsi_close = rsi_close.loc[rsi_close.notna().any(axis = 1), :]
+    rsi = rsi_close.to_numpy(dtype = float)[np.newaxis]
+    valid = ~np.isnan(rsi)
+
+    def kernel(grid_):
+        levels = grid_.to_numpy(dtype = float, na_value = np.inf)[:, :, np.newaxis, np.newaxis]
+        positions = _generate_position_signal_rsi(rsi, levels[:, 0], levels[:, 1], levels[:, 2], axis = 1)
+        # NO POSITION WHERE RSI IS MISSING
+        positions &= valid
+        return positions
+
+    return _run_sweep(grid, kernel, rsi_close.index, rsi_close.columns, output, chunk_size)
+
+@timed("positions")
+def sweep_positions_macd(macd_close, rsi_close, entry_rsi_ranges, exit_rsi_ranges, output = "positions", chunk_size = 256):
+    """
+    Generate positions for every combination of MACD+RSI ranges in one pass, in a (num of combinations, num of trading days, num of instruments) layout.
+    Positions of each combination equal generate_positions_macd(macd_close, rsi_close, entry_rsi_range, exit_rsi_range).
+
+    Parameters:
+        macd_close (pd.DataFrame): All MACD signal values.
+        rsi_close (pd.DataFrame): All RSI time series values.
+        entry_rsi_ranges (list of tuple): RSI ranges (exclusive) to enter a long position on a MACD crossover.
+        exit_rsi_ranges (list of tuple): RSI ranges (exclusive) to exit an existing long position.
+        output (str): One of ["positions", "summary"]. "positions" returns the positions indexed by (entry_rsi_lower, entry_rsi_upper, exit_rsi_lower, exit_rsi_upper, date),
+            "summary" returns one row of summary statistics per combination.
+        chunk_size (int): Number of combinations evaluated at once. Bounds peak memory.
+
+    Returns:
+        pd.DataFrame: Tidy table of positions or summary statistics for each combination.
+    """
+    grid = pd.DataFrame(
+        [(*entry, *exit_) for entry, exit_ in itertools.product(entry_rsi_ranges, exit_rsi_ranges)],
+        columns = ["entry_rsi_lower", "entry_rsi_upper", "exit_rsi_lower", "exit_rsi_upper"]
+    )
+    macd = macd_close.to_numpy(dtype = float)[np.newaxis]
+    rsi = rsi_close.loc[macd_close.index, macd_close.columns].to_numpy(dtype = float)[np.newaxis]
+
+    def kernel(grid_):
+        bounds = grid_.to_numpy(dtype = float)[:, :, np.newaxis, np.newaxis]
+        return _generate_position_signal_macd(macd, rsi, (bounds[:, 0], bounds[:, 1]), (bounds[:, 2], bounds[:, 3]), axis = 1)
+
+    return _run_sweep(grid, kernel, macd_close.index, macd_close.columns, output, chunk_size)
@@ -0,0 +1,71 @@
+import pandas as pd
+import numpy as np
+from scipy import sparse
+
+from config import PRICE_STORE_PATH
+from source.price_store import load_prices
+from source.backtest import iter_backtest
+from source.instrumentation import timed
+
+@timed("read")
+def load_universe(tickers = None, start = None, end = None, dtype = np.float32, path = PRICE_STORE_PATH):
+    """
+    Load the prices of a large universe of instruments from the price store in a compact dtype, one field at a time.
+    Instruments listed after start, or delisted before end, are missing (NaN) outside their trading history.
+
+    Parameters:
+        tickers (list of str): Tickers to load. Default is all stored tickers.
+        start (datetime): First date to load (inclusive). Default is the first stored date.
+        end (datetime): Last date to load (inclusive). Default is the last stored date.
+        dtype (np.dtype): Dtype of the prices. Default is float32, half the memory of float64, but rounded: backtests on float32 prices
+            can buy different share counts than on float64 prices. Set to np.float64 to reproduce read_data().
+        path (str): Directory of the price store.
+
+    Returns:
+        tuple: Tuple of two dataframes (prices_close, prices_open) of the size (n, len(tickers)).
+    """
+    prices_close, prices_open = [
+        load_prices(path, fields = [field], tickers = tickers, start = start, end = end).loc[:, field].astype(dtype)
+        for field in ("Close", "Open")
+    ]
+    return prices_close, prices_open
+
+@timed("backtest")
+def run_backtest_universe(positions_signals, prices_open, prices_close, weights = None, allocation_method = "equal", chunk_size = 2520):
+    """
+    Conduct backtesting of a large universe block by block of trading days with iter_backtest(), keeping the outputs compact:
+    holdings are integer share counts stored sparsely, since most instruments are not held most of the time.
+    Missing signals, eg. before an instrument is listed, count as no position. Otherwise identical to run_backtest() on the same prices,
+    note that the float32 prices of load_universe() can give different share counts than float64 prices.
+
+    Parameters:
+        positions_signals (pd.DataFrame): DataFrame of market signals generated (1: long, 0: no position), shape is (num of trading days, num of instruments).
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+        weights (pd.DataFrame): DataFrame of the weights for portfolio allocation, shape is (num of trading days, num of instruments).
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+        chunk_size (int): Number of trading days simulated at once. Bounds peak memory.
+
+    Returns:
+        portfolio (pd.DataFrame): Sparse DataFrame of the number of open positions (in number of shares, int64) given each day, shape is (num of trading days, num of instruments).
+        summary (pd.DataFrame): DataFrame of the total market closing value of the portfolio including cash ("value"), the cash account ("cash")
+            and the number of trades executed ("num_trades", int32) each day, shape is (num of trading days - 1, 3).
+    """
+    # COMPACT SIGNALS, MISSING AS NO POSITION
+    chunks = (positions_signals.iloc[start:(start + chunk_size)].astype(float).fillna(0).astype(np.int8) for start in range(0, len(positions_signals), chunk_size))
+    holdings, values, cash, num_trades = list(), list(), list(), list()
+    for portfolio, portfolio_value, trade_count in iter_backtest(chunks, prices_open, prices_close, weights, allocation_method):
+        holdings.append(sparse.csr_matrix(portfolio.to_numpy().astype(np.int64)))
+        # THE LAST COLUMN OF portfolio_value IS THE CASH ACCOUNT
+        cash_accounts = portfolio_value.iloc[:, -1].to_numpy(dtype = float)
+        values.append(portfolio_value.iloc[:, :-1].to_numpy().sum(axis = 1) + cash_accounts)
+        cash.append(cash_accounts)
+        num_trades.append(trade_count.iloc[:, 0].to_numpy().astype(np.int32))
+
+    portfolio = pd.DataFrame.sparse.from_spmatrix(sparse.vstack(holdings), index = positions_signals.index, columns = positions_signals.columns)
+    # THE FIRST DAY CARRIES NO CASH OR TRADE RECORD, AS IN run_backtest()
+    return portfolio, pd.DataFrame({
+        "value" : np.concatenate(values),
+        "cash" : np.concatenate(cash),
+        "num_trades" : np.concatenate(num_trades)
+    }, index = positions_signals.index[1:])
@@ -1,2 +1,9 @@
-def calculate_voladj_weights(prices_close, window = 50):
-    return prices_close.shift(1).pct_change().rolling(window).mean() / prices_close.shift(1).pct_change().rolling(window).std()
\ No newline at end of file
+from source.cache import disk_cache
+from source.instrumentation import timed
+from source.rolling import RollingStats
+
+@timed("weights")
+@disk_cache(ignore = ("stats", ))
+def calculate_voladj_weights(prices_close, window = 50, stats = None):
+    stats = RollingStats(prices_close) if stats is None else stats
+    return stats.mean(window) / stats.std(window)
@@ -0,0 +1,194 @@
+import itertools
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from source.generate_positions_rsi import generate_positions_rsi
+from source.generate_positions_macd import generate_positions_macd
+from source.backtest import run_backtest_compact
+from source.metrics import calculate_result_metrics
+
+# PANELS OF THE CURRENT PROCESS, SET ONCE PER WORKER FROM SHARED MEMORY
+_PANELS = dict()
+_SHARED_BLOCKS = list()
+
+def make_folds(dates, train_size, test_size, expanding = False):
+    """
+    Split trading days into consecutive train/test folds. Each test fold follows its train fold, and folds move forward by test_size days.
+
+    Parameters:
+        dates (pd.Index): Trading days.
+        train_size (int): Number of trading days in each train fold (the first one, if expanding).
+        test_size (int): Number of trading days in each test fold.
+        expanding (bool): Set to True for train folds all starting on the first day, otherwise train folds roll forward.
+
+    Returns:
+        pd.DataFrame: One row per fold, with the first and last days of the train and test folds.
+    """
+    folds = list()
+    for test_start in range(train_size, len(dates), test_size):
+        train_start = 0 if expanding else test_start - train_size
+        test_end = min(test_start + test_size, len(dates))
+        folds.append({
+            "train_start" : dates[train_start], "train_end" : dates[test_start - 1],
+            "test_start" : dates[test_start], "test_end" : dates[test_end - 1]
+        })
+    return pd.DataFrame(folds, columns = ["train_start", "train_end", "test_start", "test_end"])
+
+def _share_panels(panels):
+    """
+    Copy DataFrames into shared memory blocks.
+
+    Parameters:
+        panels (dict of pd.DataFrame): DataFrames to share, None values are skipped.
+
+    Returns:
+        blocks (list of SharedMemory): Blocks to close and unlink once the workers are done.
+        specs (dict): Dictionary with each key being a panel name, each item the (block name, dtype, index, columns) to attach to it.
+    """
+    blocks, specs = list(), dict()
+    for name, panel in panels.items():
+        if panel is None:
+            continue
+        values = panel.to_numpy(dtype = float)
+        block = shared_memory.SharedMemory(create = True, size = max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype = values.dtype, buffer = block.buf)[:] = values
+        blocks.append(block)
+        specs[name] = (block.name, values.dtype.str, panel.index, panel.columns)
+    return blocks, specs
+
+def _attach_panels(specs):
+    """
+    Worker initialiser: wrap the shared memory blocks as DataFrames without copying them.
+    """
+    for name, (block_name, dtype, index, columns) in specs.items():
+        block = shared_memory.SharedMemory(name = block_name)
+        # KEEP THE BLOCK OPEN FOR THE LIFETIME OF THE WORKER
+        _SHARED_BLOCKS.append(block)
+        values = np.ndarray((len(index), len(columns)), dtype = dtype, buffer = block.buf)
+        _PANELS[name] = pd.DataFrame(values, index = index, columns = columns, copy = False)
+
+def _generate_positions(strategy, params, end):
+    """
+    Generate the positions of a strategy from the panels of the current process, up to day end.
+    """
+    match strategy:
+        case "rsi":
+            return generate_positions_rsi(_PANELS["rsi_close"].loc[:end, :], **params).astype(float).fillna(0)
+        case "macd":
+            return generate_positions_macd(_PANELS["macd_signal"].loc[:end, :], _PANELS["rsi_close"], **params)
+        case _:
+            raise ValueError(f"Invalid strategy: {strategy}")
+
+def _evaluate(strategy, params, start, end, allocation_method):
+    """
+    Backtest a strategy over [start, end] from a fresh capital, and calculate its metrics.
+
+    Returns:
+        dict: Metrics of calculate_portfolio_metrics().
+    """
+    positions_signals = _generate_positions(strategy, params, end).loc[start:end, :]
+    prices_open, prices_close = _PANELS["prices_open"], _PANELS["prices_close"]
+    result = run_backtest_compact(positions_signals, prices_open, prices_close, _PANELS.get("weights"), allocation_method)
+    metrics, _ = calculate_result_metrics(result, prices_open)
+    return metrics
+
+def _evaluate_many(strategy, grid, start, end, allocation_method):
+    """
+    Evaluate several parameter combinations on the same window, one task of the process pool.
+    """
+    return [_evaluate(strategy, params, start, end, allocation_method) for params in grid]
+
+def walk_forward(strategy, param_grid, prices_open, prices_close, rsi_close, macd_signal = None, weights = None, allocation_method = "equal",
+                 train_size = 2520, test_size = 252, expanding = False, objective = "Sharpe Ratio", n_jobs = 1, chunk_size = 16):
+    """
+    Walk-forward optimisation: on each train fold, pick the parameters maximising the objective, then evaluate them on the following test fold.
+    Indicators are computed once over the whole history, as they only look backwards. Each backtest starts from CAPITAL_0.
+    With n_jobs > 1, the price panels are placed in shared memory once and read by every worker process, instead of being pickled to them.
+
+    Parameters:
+        strategy (str): One of ["rsi", "macd"], ie. generate_positions_rsi() or generate_positions_macd().
+        param_grid (dict): Dictionary with each key being a parameter of the position generator, each item the list of values to try,
+            eg. {"buy_level" : [20, 25, 30], "sell_level" : [70, 75, 80]}.
+        prices_open (pd.DataFrame): DataFrame of the market open prices, shape is (num of trading days, num of instruments).
+        prices_close (pd.DataFrame): DataFrame of the market close prices, shape is (num of trading days, num of instruments).
+        rsi_close (pd.DataFrame): All RSI time series values.
+        macd_signal (pd.DataFrame): All MACD signal values. Required for "macd".
+        weights (pd.DataFrame): DataFrame of the weights for portfolio allocation, shape is (num of trading days, num of instruments).
+        allocation_method (str): One of ["equal", "hrp", "voladj"].
+        train_size (int): Number of trading days in each train fold (the first one, if expanding).
+        test_size (int): Number of trading days in each test fold.
+        expanding (bool): Set to True for expanding train folds, otherwise train folds roll forward.
+        objective (str): Metric of calculate_portfolio_metrics() maximised on each train fold.
+        n_jobs (int): Number of worker processes. Default is 1, ie. no process pool.
+        chunk_size (int): Number of parameter combinations evaluated per task.
+
+    Returns:
+        folds (pd.DataFrame): One row per fold, with its dates, the chosen parameters, the train objective and the test metrics.
+        train_results (pd.DataFrame): Metrics of every parameter combination on every train fold.
+    """
+    if strategy == "macd":
+        assert macd_signal is not None, "macd_signal cannot be None when macd is chosen."
+    grid = [dict(zip(param_grid.keys(), values)) for values in itertools.product(*param_grid.values())]
+    signals_index = rsi_close.index if strategy == "rsi" else macd_signal.index
+    folds = make_folds(signals_index, train_size, test_size, expanding)
+    panels = {"prices_open" : prices_open, "prices_close" : prices_close, "rsi_close" : rsi_close, "macd_signal" : macd_signal, "weights" : weights}
+
+    blocks, pool = list(), None
+    try:
+        if n_jobs > 1:
+            blocks, specs = _share_panels(panels)
+            pool = ProcessPoolExecutor(max_workers = n_jobs, initializer = _attach_panels, initargs = (specs, ))
+            submit = pool.submit
+        else:
+            _PANELS.clear()
+            _PANELS.update({name : panel for name, panel in panels.items() if panel is not None})
+            submit = lambda func, *args : _Done(func(*args))
+
+        # TRAIN FOLDS: EVERY PARAMETER COMBINATION
+        futures = {
+            (i, start) : submit(_evaluate_many, strategy, grid[start:(start + chunk_size)], fold.train_start, fold.train_end, allocation_method)
+            for i, fold in enumerate(folds.itertuples()) for start in range(0, len(grid), chunk_size)
+        }
+        train_results = list()
+        for (i, start), future in futures.items():
+            for k, metrics in enumerate(future.result()):
+                train_results.append({"fold" : i, "combination" : start + k, **grid[start + k], **metrics})
+        train_results = pd.DataFrame(train_results)
+
+        # TEST FOLDS: BEST PARAMETERS OF THE TRAIN FOLD
+        best = train_results.loc[:, objective].fillna(-np.inf).groupby(train_results.loc[:, "fold"]).idxmax()
+        best = train_results.loc[best.to_numpy(), :].set_index("fold")
+        futures = {
+            i : submit(_evaluate, strategy, grid[best.loc[i, "combination"]], fold.test_start, fold.test_end, allocation_method)
+            for i, fold in enumerate(folds.itertuples())
+        }
+        test_results = pd.DataFrame([future.result() for future in futures.values()], index = list(futures.keys()))
+    finally:
+        # RELEASE THE PANELS OF THE SERIAL PATH
+        _PANELS.clear()
+        if pool is not None:
+            pool.shutdown()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    folds = pd.concat((
+        folds,
+        best.loc[:, list(param_grid.keys())],
+        best.loc[:, [objective]].add_prefix("train "),
+        test_results.add_prefix("test ")
+    ), axis = 1)
+    return folds, train_results
+
+class _Done:
+    """
+    Result of a task run in the current process, with the interface of a Future.
+    """
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
@@ -0,0 +1,96 @@
+import warnings
+
+import numpy as np
+import pytest
+from pandas.testing import assert_frame_equal
+
+from source.benchmark import make_synthetic_prices
+from source.calculate_rsi import calculate_rsi
+from source.calculate_macd import calculate_macd_signal
+from source.generate_positions_rsi import generate_positions_rsi
+from source.generate_positions_macd import generate_positions_macd
+from source.hrp import calculate_hrp_weights
+from source.voladj import calculate_voladj_weights
+from source.backtest import run_backtest, run_backtest_array, run_backtest_batch, write_backtest, read_backtest
+
+def _inputs(num_tickers, allocation_method, seed = 0):
+    """
+    Positions, prices and weights of a ragged synthetic panel, computed without the disk cache.
+    """
+    prices = make_synthetic_prices(num_tickers, 600, ragged = True, gap_rate = .01, seed = seed)
+    prices_close, prices_open = prices.loc[:, "Close"], prices.loc[:, "Open"]
+    rsi_close = calculate_rsi.uncached(prices_close, "sma", 14)
+    if allocation_method == "equal":
+        positions = generate_positions_rsi(rsi_close, 25, 75).fillna(0)
+    else:
+        positions = generate_positions_macd(calculate_macd_signal.uncached(prices_close), rsi_close, (25, 50), (80, 100))
+    match allocation_method:
+        case "equal":
+            weights = None
+        case "hrp":
+            # WEIGHTS ARE ONLY READ ON THE DAYS THE SIGNAL CHANGES
+            rebalance_dates = positions.index[positions.ne(positions.shift()).any(axis = 1)]
+            weights = calculate_hrp_weights.uncached(prices_close, 50, rebalance_dates = rebalance_dates)
+        case "voladj":
+            weights = calculate_voladj_weights.uncached(prices_close, 50)
+    return positions, prices_open, prices_close, weights
+
+@pytest.mark.parametrize("num_tickers", [7, 12])
+@pytest.mark.parametrize("allocation_method", ["equal", "hrp", "voladj"])
+def test_run_backtest_array_matches_run_backtest(num_tickers, allocation_method):
+    positions, prices_open, prices_close, weights = _inputs(num_tickers, allocation_method)
+    expected = run_backtest(positions, prices_open, prices_close, weights, allocation_method)
+    outputs = run_backtest_array(positions, prices_open, prices_close, weights, allocation_method)
+    for output, expected_output in zip(outputs, expected):
+        assert_frame_equal(output, expected_output, check_exact = True)
+
+@pytest.mark.parametrize("num_tickers", [7, 12])
+def test_run_backtest_batch_matches_run_backtest_array(num_tickers):
+    strategies = dict()
+    for allocation_method in ("equal", "hrp", "voladj"):
+        positions, prices_open, prices_close, weights = _inputs(num_tickers, allocation_method)
+        strategies[allocation_method] = {"positions_signals" : positions, "weights" : weights, "allocation_method" : allocation_method}
+        # A SECOND STRATEGY, TRADING ON SOME OF THE SAME DAYS
+        strategies[allocation_method + " (lagged)"] = {**strategies[allocation_method], "positions_signals" : positions.shift(5).fillna(0)}
+    outputs = run_backtest_batch(strategies, prices_open, prices_close)
+    for name, spec in strategies.items():
+        expected = run_backtest_array(spec["positions_signals"], prices_open, prices_close, spec["weights"], spec["allocation_method"])
+        for output, expected_output in zip(outputs[name], expected):
+            assert_frame_equal(output, expected_output, check_exact = True)
+
+@pytest.mark.parametrize("allocation_method", ["equal", "hrp"])
+def test_write_backtest_round_trip(allocation_method, tmp_path):
+    positions, prices_open, prices_close, weights = _inputs(7, allocation_method)
+    expected = run_backtest_array(positions, prices_open, prices_close, weights, allocation_method)
+    # BLOCKS SMALLER THAN THE HISTORY, APPENDED ONE AT A TIME
+    write_backtest(str(tmp_path), positions, prices_open, prices_close, weights, allocation_method, chunk_size = 100)
+    for output, expected_output in zip(read_backtest(str(tmp_path)), expected):
+        # THE STORE KEEPS THE DATES, NOT THE FREQUENCY OF THE INDEX
+        assert_frame_equal(output, expected_output, check_exact = True, check_freq = False)
+
+@pytest.mark.parametrize("filled", [False, True])
+def test_ticker_without_rsi(filled):
+    prices = make_synthetic_prices(7, 600, ragged = True, gap_rate = .01)
+    prices_close, prices_open = prices.loc[:, "Close"].copy(), prices.loc[:, "Open"].copy()
+    prices_close.loc[:, "DEAD"], prices_open.loc[:, "DEAD"] = np.nan, np.nan
+    # OBJECT COLUMN OF NAN, OR OF ZEROS ONCE FILLED
+    positions = generate_positions_rsi(calculate_rsi.uncached(prices_close, "sma", 14), 30, 70)
+    assert positions.loc[:, "DEAD"].dtype == object
+    if filled:
+        positions = positions.astype(float).fillna(0).astype({"DEAD" : object})
+    expected = run_backtest(positions, prices_open, prices_close)
+    outputs = run_backtest_array(positions, prices_open, prices_close)
+    for output, expected_output in zip(outputs, expected):
+        assert_frame_equal(output, expected_output, check_exact = True)
+
+@pytest.mark.parametrize("weight", [np.nan, -1.])
+def test_voladj_without_usable_weights_is_silent(weight):
+    positions, prices_open, prices_close, weights = _inputs(7, "voladj")
+    # NO ELIGIBLE INSTRUMENT HAS A POSITIVE WEIGHT
+    weights.loc[:, :] = weight
+    expected = run_backtest(positions, prices_open, prices_close, weights, "voladj")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        outputs = run_backtest_array(positions, prices_open, prices_close, weights, "voladj")
+    for output, expected_output in zip(outputs, expected):
+        assert_frame_equal(output, expected_output, check_exact = True)
@@ -0,0 +1,41 @@
+import pickle
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from source.benchmark import make_synthetic_prices
+from source.calculate_rsi import calculate_rsi
+from source.calculate_macd import calculate_macd_signal
+from source.streaming import StreamingRSI, StreamingMACDSignal
+
+def _replay(make_indicator, prices, restart):
+    """
+    Feed prices to a streaming indicator one bar at a time, moving its state to a new indicator (through a pickled snapshot) before bar restart.
+    """
+    indicator, values = make_indicator(), list()
+    for i, (date, bar) in enumerate(prices.iterrows()):
+        if i == restart:
+            state = pickle.loads(pickle.dumps(indicator.snapshot()))
+            indicator = make_indicator()
+            indicator.restore(state)
+        values.append(indicator.update(bar).rename(date))
+    return pd.DataFrame(values).rename_axis(index = prices.index.name, columns = prices.columns.name)
+
+def _assert_matches_batch(streamed, batch):
+    # THE BATCH FUNCTIONS DROP DAYS WITHOUT ANY VALUE
+    assert streamed.drop(index = batch.index).isna().all().all()
+    assert_frame_equal(streamed.loc[batch.index, :], batch, check_exact = True, check_freq = False)
+
+@pytest.fixture(scope = "module")
+def prices_close():
+    return make_synthetic_prices(7, 600, ragged = True, gap_rate = .02, seed = 3).loc[:, "Close"]
+
+@pytest.mark.parametrize("smoothing", ["sma", "ema"])
+def test_streaming_rsi_matches_calculate_rsi(prices_close, smoothing):
+    streamed = _replay(lambda : StreamingRSI(prices_close.columns, smoothing, 14), prices_close, restart = 300)
+    _assert_matches_batch(streamed, calculate_rsi.uncached(prices_close, smoothing, 14))
+
+def test_streaming_macd_signal_matches_calculate_macd_signal(prices_close):
+    streamed = _replay(lambda : StreamingMACDSignal(prices_close.columns), prices_close, restart = 300)
+    _assert_matches_batch(streamed, calculate_macd_signal.uncached(prices_close))